@@ -1,16 +1,17 @@
 #!/usr/bin/env python
 from functools import partial
 import itertools
+import math
 import random
 import struct
 import sys
-import urllib
-import time
 
 from Crypto.Cipher import AES
 
 import md4
 from md4 import int_array2str, U32
+from httpdriver import HTTPDriver
+from wordlist import open_wordlist
 
 random.seed('matasano') #for reproducibility - will work with any seed
 
@@ -57,12 +58,120 @@ def pkcs7_strip(data):
     return data[:-padlen]
 
 
-def get_status(url):
-    r = urllib.urlopen(url)
-    status = r.getcode()
-    r.read()
-    r.close()
-    return status
+def median(lst):
+    s = sorted(lst)
+    mid = len(s) // 2
+    return s[mid] if len(s) % 2 else (s[mid-1] + s[mid]) / 2.0
+
+
+def normal_quantile(p):
+    """z with P(Z > z) = p for a standard normal Z, by bisection."""
+    lo, hi = 0.0, 40.0
+    for _ in xrange(100):
+        z = (lo + hi) / 2
+        if 0.5 * math.erfc(z / math.sqrt(2)) > p:
+            lo = z
+        else:
+            hi = z
+    return z
+
+
+class TimingLeakError(Exception):
+    pass
+
+
+def timing_leak_attack(fprobe, siglen=40, alphabet='0123456789abcdef',
+        min_rounds=2, guard_rounds=10, max_rounds=200, alpha=0.01, max_requests=None, fmap=map):
+    """Recover a signature one character at a time through a timing leak.
+
+    fprobe(sig) makes a single request and returns (elapsed, status). Each
+    round times every candidate once, in shuffled order so drift in the
+    network or server hits all candidates alike. After every round the
+    slowest candidate's median is tested against the median of all the
+    other candidates' samples pooled. The standard error comes from the
+    median absolute deviation of the pooled samples. A character is
+    accepted once the difference is significant at level `alpha`,
+    Bonferroni-corrected for picking the best of the candidates and for
+    looking after every one of max_rounds rounds.
+
+    The normal approximation behind that test is poor for a median of a
+    handful of samples when the noise has a long tail. Before guard_rounds
+    rounds, a character is only accepted if also every one of its samples
+    is slower than every sample of the others, so a strong leak is taken
+    after min_rounds rounds and a weak one waits for the test to hold up.
+
+    If no candidate separates, some earlier character was wrong. The
+    attack then re-tests the prefix from the end, dropping characters
+    until one is confirmed again. It raises TimingLeakError after
+    max_requests requests (by default enough for every position to be
+    tried four times over). Pass an HTTPDriver's map as fmap to keep a
+    round's probes in flight concurrently.
+
+    Returns the signature and the number of requests made.
+    """
+    if max_requests is None:
+        max_requests = 4 * siglen * len(alphabet) * max_rounds
+    z_accept = normal_quantile(alpha / (len(alphabet) * max_rounds))
+    #MAD -> standard deviation (normal) -> standard error of a median
+    se_scale = 1.4826 * 1.2533
+    requests = [0]
+
+    def next_char(prefix):
+        """(c, done): the leaking next character or None, and whether
+        prefix + c was accepted outright."""
+        samples = dict((c, []) for c in alphabet)
+        for rnd in xrange(1, max_rounds + 1):
+            if requests[0] >= max_requests:
+                raise TimingLeakError('no signature after %d requests' % requests[0])
+            order = list(alphabet)
+            random.shuffle(order)
+            results = fmap(fprobe, [prefix + c for c in order])
+            requests[0] += len(order)
+            for c, (elapsed, status) in zip(order, results):
+                if status == 200:
+                    return c, True
+                samples[c].append(elapsed)
+
+            #every candidate for the last character was rejected
+            if len(prefix) + 1 == siglen:
+                return None, False
+            if rnd < min_rounds:
+                continue
+
+            medians = dict((c, median(ts)) for c,ts in samples.iteritems())
+            best = max(alphabet, key=medians.get)
+            others = [t for c,ts in samples.iteritems() if c != best for t in ts]
+            base = median(others)
+            mad = median([abs(t - base) for t in others])
+            se = se_scale * mad * math.sqrt(1.0 / rnd + 1.0 / len(others))
+            if medians[best] - base > z_accept * se and (
+                    rnd >= guard_rounds or min(samples[best]) > max(others)):
+                return best, False
+        return None, False
+
+    sig = ''
+    while len(sig) < siglen:
+        c, done = next_char(sig)
+        if done:
+            return sig + c, requests[0]
+        if c is not None:
+            sig += c
+            print sig, requests[0]
+            continue
+
+        #no signal: walk back until a character re-tests the same
+        while sig:
+            c, done = next_char(sig[:-1])
+            if done:
+                return sig[:-1] + c, requests[0]
+            if c == sig[-1]:
+                break
+            sig = sig[:-1]
+            if c is not None:
+                sig += c
+                break
+        print 'No signal, backtracked to:', repr(sig)
+    return sig, requests[0]
 
 
 #https://github.com/ajalt/python-sha1
@@ -390,7 +499,7 @@ Forge a variant of this message that ends with ";admin=true".
         pad += struct.pack('>Q', original_bit_len)
         return pad
 
-    key = random.choice(open('/usr/share/dict/words').readlines()).strip()
+    key = open_wordlist().choice()
     message = "comment1=cooking%20MCs;userdata=foo;comment2=%20like%20a%20pound%20of%20bacon"
     mac = sha1(key + message)
     print 'Message:', message
@@ -450,7 +559,7 @@ implementation of MD4.
     def authenticate(key, mac, message):
         return md4.md4_hash(key + message) == mac
 
-    key = random.choice(open('/usr/share/dict/words').readlines()).strip()
+    key = open_wordlist().choice()
     message = "comment1=cooking%20MCs;userdata=foo;comment2=%20like%20a%20pound%20of%20bacon"
     mac = md4.md4_hash(key + message)
     print 'Message:', message
@@ -505,29 +614,19 @@ the MAC is invalid, and a 200 if it's OK.
 Using the timing leak in this application, write a program that
 discovers the valid MAC for any file.
 """
-    def recover_sig(url, fname):
-        baseurl = url + '?file=%s&signature=%%s' % fname
-        sig = ''
-        while len(sig) < 40:
-            c_time = {}
-            for c in '0123456789abcdef':
-                url = baseurl % sig + c
-                tstart = time.time()
-                get_status(url)
-                tstop = time.time()
-                c_time[c] = tstop - tstart
-            t,c = max((t,c) for c,t in c_time.iteritems())
-            sig += c
-            print sig
+    def recover_sig(driver, fname):
+        query = 'file=%s&signature=%%s' % fname
+        sig, requests = timing_leak_attack(lambda sig: driver.request(query % sig), fmap=driver.map)
+        print 'Requests:', requests
         return sig
 
 
-    url = 'http://localhost:9000/test31'
-    fname = random.choice(open('/usr/share/dict/words').readlines()).strip()
+    driver = HTTPDriver('http://localhost:9000/test31')
+    fname = open_wordlist().choice()
     print 'Finding HMAC for:', fname
-    sig = recover_sig(url, fname)
-    url = url + '?file=%s&signature=%s' % (fname, sig)
-    status = get_status(url)
+    sig = recover_sig(driver, fname)
+    status = driver.get_status('file=%s&signature=%s' % (fname, sig))
+    driver.close()
     print status, fname, sig
 
 
@@ -539,31 +638,21 @@ solution breaks. (Try 5ms to start.)
 
 Now break it again.
 """
-    print "5ms: do 5 rounds to increase delta between good and bad times"
-
-    def recover_sig(url, fname):
-        baseurl = url + '?file=%s&signature=%%s' % fname
-        sig = ''
-        while len(sig) < 40:
-            c_time = {}
-            for c in '0123456789abcdef':
-                url = baseurl % sig + c
-                tstart = time.time()
-                for _ in xrange(5):
-                    get_status(url)
-                tstop = time.time()
-                c_time[c] = tstop - tstart
-            t,c = max((t,c) for c,t in c_time.iteritems())
-            sig += c
-            print sig
+    print "5ms: keep sampling each candidate until its median separates from the rest"
+
+    def recover_sig(driver, fname):
+        query = 'file=%s&signature=%%s' % fname
+        sig, requests = timing_leak_attack(lambda sig: driver.request(query % sig), fmap=driver.map)
+        print 'Requests:', requests
         return sig
 
-    url = 'http://localhost:9000/test32'
-    fname = random.choice(open('/usr/share/dict/words').readlines()).strip()
+
+    driver = HTTPDriver('http://localhost:9000/test32')
+    fname = open_wordlist().choice()
     print 'Finding HMAC for:', fname
-    sig = recover_sig(url, fname)
-    url = url + '?file=%s&signature=%s' % (fname, sig)
-    status = get_status(url)
+    sig = recover_sig(driver, fname)
+    status = driver.get_status('file=%s&signature=%s' % (fname, sig))
+    driver.close()
     print status, fname, sig
 
 
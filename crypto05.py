@@ -2,11 +2,16 @@
 import sys
 import hmac
 from hashlib import sha1, sha256
+import multiprocessing
 import random
 import itertools
+import time
 
 from Crypto.Cipher import AES
-from Crypto.Util.number import getStrongPrime
+from Crypto.Util.number import getPrime, getStrongPrime
+
+import protosim
+from wordlist import open_wordlist
 
 random.seed('matasano') #for reproducibility - will work with any seed
 
@@ -33,7 +38,17 @@ def grouper(n, iterable, fillvalue=None):
 
 def make_keys(p, g):
     x = random.randint(0, sys.maxint) % p
-    return x, pow(g, x, p) #(g**x) % p
+    return x, fixed_base(g, p, sys.maxint.bit_length())(x) #(g**x) % p
+
+
+def make_keys_batch(p, g, count):
+    """count key pairs for the group (p, g), sharing one fixed-base table."""
+    gpow = fixed_base(g, p, sys.maxint.bit_length())
+    keys = []
+    for _ in xrange(count):
+        x = random.randint(0, sys.maxint) % p
+        keys.append((x, gpow(x)))
+    return keys
 
 
 def random_key(keylen):
@@ -41,7 +56,7 @@ def random_key(keylen):
 
 
 def random_word():
-    return random.choice(open('/usr/share/dict/words').readlines()).strip()
+    return open_wordlist().choice()
 
 
 def pkcs7_pad(blocklen, data):
@@ -72,6 +87,134 @@ def aes_decrypt(key, iv, data, mode=AES.MODE_CBC):
     return pkcs7_strip(AES.new(key, IV=iv, mode=mode).decrypt(data))
 
 
+class FixedBasePow(object):
+    """pow(g, e, N) for fixed g and N, from a table of g**(d * 2**(w*i)) for
+    every w-bit digit d at every digit position i. An exponentiation then
+    costs one multiplication per nonzero digit of e and no squarings.
+    Exponents wider than `bits` fall back to pow().
+    """
+    def __init__(self, g, N, bits, w=8):
+        self.N, self.w, self.mask = N, w, (1 << w) - 1
+        self.bits = bits
+        self.table = []
+        base = g % N
+        for _ in xrange((bits + w - 1) // w):
+            row = [1]
+            for _ in xrange(self.mask):
+                row.append(row[-1] * base % N)
+            self.table.append(row)
+            base = row[-1] * base % N
+        self.g = g
+
+    def __call__(self, e):
+        if e.bit_length() > self.bits:
+            return pow(self.g, e, self.N)
+        N, w, mask = self.N, self.w, self.mask
+        result = 1
+        for row in self.table:
+            if not e:
+                break
+            d = e & mask
+            if d:
+                result = result * row[d] % N
+            e >>= w
+        return result
+
+
+fixed_base_tables = {}
+
+def fixed_base(g, p, bits, w=8):
+    """Cached FixedBasePow for exponents of up to `bits` bits in group (p, g)."""
+    key = g, p, bits, w
+    if key not in fixed_base_tables:
+        fixed_base_tables[key] = FixedBasePow(g, p, bits, w)
+    return fixed_base_tables[key]
+
+
+class SRPCracker(object):
+    """Checks candidate passwords against a captured simplified-SRP session
+    (cc38), where the attacker posing as the server chose b, u and salt.
+
+    The server computes S = (A * v**u)**b with v = g**x, which is
+    A**b * g**(x*u*b). A**b is fixed for the whole run, so each word costs a
+    single fixed-base exponentiation by x*u*b instead of three pow() calls.
+    """
+    def __init__(self, session, fixed_base=True):
+        N, g, A, b, u, self.salt, self.h = session
+        self.N, self.g, self.A, self.b, self.u = N, g, A, b, u
+        self.Ab = pow(A, b, N)
+        self.ub = u * b
+        self.fixed_base = fixed_base
+        if fixed_base:
+            #x is a sha256, so x*u*b needs 256 more bits than u*b
+            self.gpow = FixedBasePow(g, N, bits=min(N.bit_length(), 256 + self.ub.bit_length()))
+
+    def session_key(self, word):
+        x = int(sha256(self.salt + word).hexdigest(), 16)
+        N = self.N
+        if not self.fixed_base:
+            v = pow(self.g, x, N)
+            return pow(self.A * pow(v, self.u, N), self.b, N)
+        #g has order dividing N-1 since N is prime
+        return self.Ab * self.gpow(x * self.ub % (N - 1)) % N
+
+    def check(self, word):
+        K = sha256(str(self.session_key(word))).hexdigest()
+        return self.h == hmac.new(K, self.salt, sha256).hexdigest()
+
+
+srp_cracker = None
+
+def srp_init_worker(session):
+    global srp_cracker
+    srp_cracker = SRPCracker(session)
+
+
+def srp_check_words(words):
+    """Return (password or None, number of words tried) for one chunk of
+    candidate passwords, using the worker's SRPCracker.
+    """
+    for i, word in enumerate(words):
+        if srp_cracker.check(word):
+            return word, i + 1
+    return None, len(words)
+
+
+def srp_crack(session, chunks, processes=None):
+    """Offline dictionary attack on a simplified-SRP session, with the
+    chunks of candidate words (e.g. from WordList.chunks) spread across a
+    process pool. Each worker builds its fixed-base table once. Stops every
+    worker as soon as one finds the password.
+
+    Returns (password or None, words tried, seconds taken).
+    """
+    pool = multiprocessing.Pool(processes, srp_init_worker, (session,))
+    tstart = time.time()
+    found, tried = None, 0
+    for word, count in pool.imap_unordered(srp_check_words, chunks):
+        tried += count
+        if word is not None:
+            found = word
+            pool.terminate()
+            break
+    else:
+        pool.close()
+    pool.join()
+    return found, tried, time.time() - tstart
+
+
+def srp_benchmark(session, words):
+    """Print the per-word cost of the three-pow() check and the fixed-base one."""
+    for comment, fixed_base in (('pow() x3:  ', False), ('fixed-base:', True)):
+        tstart = time.time()
+        cracker = SRPCracker(session, fixed_base)
+        tsetup = time.time()
+        for word in words:
+            cracker.check(word)
+        tstop = time.time()
+        print '%s %.3fms/word (setup %.0fms)' % (comment, 1000 * (tstop - tsetup) / len(words), 1000 * (tsetup - tstart))
+
+
 def invmod(a, b):
     m = b
     x, lastx = 0, 1
@@ -84,6 +227,108 @@ def invmod(a, b):
     return lastx % m
 
 
+def nth_root(x, n):
+    """Finds the integer component of the n'th root of x,
+    an integer such that y ** n <= x < (y + 1) ** n.
+
+    Newton's method, started just above the root from a floating point
+    root of the leading bits of x, so it only needs a few iterations.
+    """
+    if x < 0:
+        raise ValueError('negative radicand')
+    if x < 2 or n == 1:
+        return x
+    if n < 512:
+        #x >> shift keeps 64 to 64+n bits, well within float range
+        shift = max(0, x.bit_length() - 64) // n * n
+        y = (int((x >> shift) ** (1.0 / n)) + 2) << (shift // n)
+    else:
+        y = 1 << -(-x.bit_length() // n)
+    #from above the root, Newton descends monotonically to the floor
+    while True:
+        z = ((n - 1) * y + x // y ** (n - 1)) // n
+        if z >= y:
+            return y
+        y = z
+
+
+def nth_root_ceil(x, n):
+    """The smallest integer y such that y ** n >= x."""
+    y = nth_root(x, n)
+    return y if y ** n == x else y + 1
+
+
+def is_nth_power(x, n):
+    return nth_root(x, n) ** n == x
+
+
+def product_tree(xs):
+    """Levels of pairwise products, from the leaves xs up to their product."""
+    tree = [list(xs)]
+    while len(tree[-1]) > 1:
+        level = tree[-1]
+        tree.append([a * b for a, b in zip(level[::2], level[1::2])] + level[len(level) & ~1:])
+    return tree
+
+
+def remainder_tree(x, tree):
+    """x mod every leaf of a product tree, reducing down from the root."""
+    rems = [x]
+    for level in reversed(tree):
+        rems = [rems[i // 2] % m for i, m in enumerate(level)]
+    return rems
+
+
+def crt(residues, moduli):
+    """Chinese remainder theorem for pairwise coprime moduli using a product
+    tree. Returns (x, N) with x % n_i == c_i and N the product of moduli.
+    """
+    tree = product_tree(moduli)
+    N = tree[-1][0]
+    #N mod n_i**2 is n_i * (N/n_i mod n_i)
+    squares = [[m * m for m in level] for level in tree]
+    rems = remainder_tree(N, squares)
+    vals = [c * invmod(r // n, n) % n for c, r, n in zip(residues, rems, moduli)]
+    #combine up the tree: a node's value is v_L * N_R + v_R * N_L
+    for level in tree[:-1]:
+        pairs = zip(vals[::2], vals[1::2], level[::2], level[1::2])
+        vals = [vl * nr + vr * nl for vl, vr, nl, nr in pairs] + vals[len(vals) & ~1:]
+    return vals[0] % N, N
+
+
+def crt_naive(residues, moduli):
+    N = reduce(lambda a, b: a * b, moduli)
+    ms = [N // n for n in moduli]
+    return sum(c * m * invmod(m, n) for c, m, n in zip(residues, ms, moduli)) % N, N
+
+
+def broadcast_attack(e, captures):
+    """Hastad's broadcast attack: recover m from (n, c) pairs with
+    c = m**e % n, given at least e of them under coprime moduli.
+    """
+    x, N = crt([c % n for n, c in captures], [n for n, _ in captures])
+    m = nth_root(x, e)
+    if m ** e != x:
+        raise ValueError('m**e wraps the product of the moduli, need more ciphertexts')
+    return m
+
+
+def broadcast_benchmark(sizes=(512, 1024, 2048), exponents=(3, 17)):
+    """Time CRT and root extraction for e ciphertexts of random messages."""
+    for e in exponents:
+        for bits in sizes:
+            pubkeys = [getPrime(bits / 2) * getPrime(bits / 2) for _ in xrange(e)]
+            m = random.getrandbits(bits - 8)
+            captures = [(n, pow(m, e, n)) for n in pubkeys]
+            tstart = time.time()
+            crt_naive([c for _, c in captures], pubkeys)
+            tnaive = time.time()
+            assert broadcast_attack(e, captures) == m
+            tstop = time.time()
+            print 'e=%-3d %4d bits: naive CRT %.2fms, tree CRT + root %.2fms' % (
+                    e, bits, 1000 * (tnaive - tstart), 1000 * (tstop - tnaive))
+
+
 def cc33():
     """33. Implement Diffie-Hellman
 
@@ -192,8 +437,8 @@ injection attack; it's going to come up again.
 """
     p, g = nist_p, nist_g
     #p, g = 37, 5
-    def alice(p, g, msg):
-        a, A = make_keys(p, g)
+    def alice(p, g, msg, keys=None):
+        a, A = keys or make_keys(p, g)
         B = (yield p, g, A)
         s = pow(B, a, p)
         key = sha1('%02x' % s).digest()[:16]
@@ -205,9 +450,9 @@ injection attack; it's going to come up again.
         yield None
 
 
-    def bob():
+    def bob(keys=None):
         p, g, A = (yield)
-        b, B = make_keys(p, g)
+        b, B = keys or make_keys(p, g)
         s = pow(A, b, p)
         key = sha1('%02x' % s).digest()[:16]
         iv, msg = (yield B)
@@ -264,6 +509,14 @@ injection attack; it's going to come up again.
         print '\tM->A:', m_a
         a_m = a.send(m_a)
 
+    print
+    print 'Simulate 1000 concurrent sessions through Mallory:'
+    tstart = time.time()
+    #both ends' key pairs up front, off one fixed-base table
+    keys = iter(make_keys_batch(p, g, 2 * 1000))
+    sessions = protosim.run_sessions(lambda: [alice(p, g, random_word(), next(keys)), mallory(), bob(next(keys))], 1000)
+    protosim.report(sessions, time.time() - tstart)
+
 
 def cc35():
     """35. Implement DH with negotiated groups, and break with malicious "g" parameters
@@ -616,31 +869,28 @@ Crack the password from A's HMAC-SHA256(K, salt).
         c_s = c.send(s_c)
 
 
-    def mitm_server(N, g, words):
+    def mitm_server(N, g, chunks):
         I, A = (yield)
         salt = random_key(16)
         b, B = make_keys(N, g)
         u = random.randint(0, 2**128 - 1)
         h = (yield salt, B, u)
 
-        for i, word in enumerate(words):
-            xH = sha256(salt + word).hexdigest()
-            x = int(xH, 16)
-            v = pow(g, x, N)
-            S = pow(A * pow(v, u, N), b, N)
-            K = sha256(str(S)).hexdigest()
-            if h == hmac.new(K, salt, sha256).hexdigest():
-                print
-                print 'Found Password:', word
-                print
-                break
+        session = N, g, A, b, u, salt, h
+        head = next(chunks)
+        srp_benchmark(session, head[:200])
+        word, tried, secs = srp_crack(session, itertools.chain([head], chunks))
+        print
+        print 'Found Password:', word
+        print 'Tried %d words in %.1fs (%.0f words/s)' % (tried, secs, tried / secs)
+        print
         yield 'OK'
 
 
-    words = [line.strip() for line in open('/usr/share/dict/words')]
-    random.shuffle(words)
+    #shuffled up front, like the old list shuffle, so seeded runs match
+    chunks = open_wordlist().chunks(1000, rng=random)
     #prime the pump
-    c, s = client(p, g, email, password), mitm_server(p, g, words)
+    c, s = client(p, g, email, password), mitm_server(p, g, chunks)
     c_s, _ = c.next(), s.next()
     while c_s is not None:
         print '\tC->S:', c_s
@@ -764,26 +1014,6 @@ To decrypt RSA using a simple cube root, leave off the
 final modulus operation; just take the raw accumulated result and
 cube-root it.
 """
-    #http://stackoverflow.com/a/358134
-    def nth_root(x,n):
-        """Finds the integer component of the n'th root of x,
-        an integer such that y ** n <= x < (y + 1) ** n.
-        """
-        high = 1
-        while high ** n < x:
-            high *= 2
-        low = high/2
-        while low < high:
-            mid = (low + high) // 2
-            if low < mid and mid**n < x:
-                low = mid
-            elif high > mid and mid**n > x:
-                high = mid
-            else:
-                return mid
-        return mid + 1
-
-
     m = "Now that the party is jumping"
     print 'Encrypting:', m
     m = long(m.encode('hex'), 16)
@@ -793,21 +1023,14 @@ cube-root it.
     pubkeys = [getStrongPrime(bits, e) * getStrongPrime(bits, e) for _ in xrange(3)]
     captures = [pow(m, e, n) for n in pubkeys]
 
-    c0, c1, c2 = [c % n for c,n in zip(captures, pubkeys)]
-    n0, n1, n2 = pubkeys
-    ms0 = n1 * n2
-    ms1 = n0 * n2
-    ms2 = n0 * n1
-    N012 = n0 * n1 * n2
-
-    result = ((c0 * ms0 * invmod(ms0, n0)) +
-            (c1 * ms1 * invmod(ms1, n1)) +
-            (c2 * ms2 * invmod(ms2, n2))) % N012
-
-    m = nth_root(result, 3)
+    m = broadcast_attack(e, zip(pubkeys, captures))
     m = hex(long(m))
     m = m[2:-1].decode('hex')
     print 'Decrypted: ', m
+    print
+
+    print 'Broadcast attack timings:'
+    broadcast_benchmark()
 
 
 if __name__ == '__main__':
@@ -1,19 +1,23 @@
 #!/usr/bin/env python
 import binascii
-from fractions import Fraction
+import bisect
+from collections import defaultdict, namedtuple
 from functools import partial
 import hashlib
 import itertools
 import json
 import math
+import multiprocessing
 import random
+import sys
 import time
 
-import Crypto.Hash.SHA as SHA
+import Crypto.Random
 import Crypto.PublicKey.RSA as RSA
-import Crypto.Signature.PKCS1_v1_5 as PKCS1_v1_5
 from Crypto.Util.number import bytes_to_long, long_to_bytes, getPrime, getStrongPrime, GCD
 
+import rsaforge
+
 #random.seed('matasano') #for reproducibility - will work with any seed
 
 
@@ -37,48 +41,124 @@ def invmod(a, b):
     return lastx % m
 
 
-#http://stackoverflow.com/a/358134
-def nth_root(x,n):
-    """Finds the integer component of the n'th root of x,
-    an integer such that y ** n <= x < (y + 1) ** n.
-    """
-    high = 1
-    while high ** n < x:
-        high *= 2
-    low = high/2
-    while low < high:
-        mid = (low + high) // 2
-        if low < mid and mid**n < x:
-            low = mid
-        elif high > mid and mid**n > x:
-            high = mid
-        else:
-            return mid
-    return mid + 1
-
-
 def rsa_encrypt(m, e, n):
     return pow(bytes_to_long(m), e, n)
 
 
-def rsa_decrypt(c, d, n):
-    return long_to_bytes(pow(c, d, n))
+#private keys carry the CRT parameters so decryption works mod p and q
+RSAPrivateKey = namedtuple('RSAPrivateKey', 'd n p q dP dQ qInv')
 
 
-def rsa_genkeys(bits, e):
-    bits = bits / 2
-    et = e
-    while GCD(e, et) != 1:
+def rsa_decrypt_long(c, d, n, p=None, q=None, dP=None, dQ=None, qInv=None):
+    if p is None:
+        return pow(c, d, n)
+    m1 = pow(c, dP, p)
+    m2 = pow(c, dQ, q)
+    return m2 + (qInv * (m1 - m2) % p) * q
+
+
+def rsa_decrypt(c, *privkey):
+    return long_to_bytes(rsa_decrypt_long(c, *privkey))
+
+
+def rsa_prime(bits, e):
+    """A random prime p of the given size with GCD(e, p-1) == 1."""
+    while True:
         if bits < 512:
             #getStrongPrime won't accept bits < 512
-            p, q = getPrime(bits), getPrime(bits)
+            p = getPrime(bits)
         else:
-            p, q = getStrongPrime(bits, e), getStrongPrime(bits, e)
-        et = (p-1) * (q-1)
+            p = getStrongPrime(bits, e)
+        if GCD(e, p - 1) == 1:
+            return p
+
 
+def rsa_keys(p, q, e):
     n = p * q
-    d = invmod(e, et)
-    return (e,n), (d,n)
+    d = invmod(e, (p-1) * (q-1))
+    return (e,n), RSAPrivateKey(d, n, p, q, d % (p-1), d % (q-1), invmod(q, p))
+
+
+def rsa_genprimes(bits, e, fprime=rsa_prime):
+    #only a prime that is unsuitable for e gets replaced
+    p = fprime(bits / 2, e)
+    q = fprime(bits / 2, e)
+    while q == p:
+        q = fprime(bits / 2, e)
+    return p, q
+
+
+def rsa_genkeys(bits, e):
+    if keysource is not None:
+        return keysource.genkeys(bits, e)
+    return rsa_keys(e=e, *rsa_genprimes(bits, e))
+
+
+def prime_worker(queue, bits, e):
+    Crypto.Random.atfork()
+    while True:
+        queue.put(rsa_prime(bits, e))
+
+
+class RSAKeyPool(object):
+    """Worker processes keep a queue of primes for (bits, e) topped up in the
+    background, so generating a key pair is mostly two queue reads.
+    """
+    def __init__(self, bits, e, processes=None, size=16):
+        self.bits, self.e = bits, e
+        self.queue = multiprocessing.Queue(size)
+        self.workers = []
+        for _ in xrange(processes or multiprocessing.cpu_count()):
+            p = multiprocessing.Process(target=prime_worker, args=(self.queue, bits / 2, e))
+            p.daemon = True
+            p.start()
+            self.workers.append(p)
+
+    def prime(self, bits, e):
+        if (bits, e) != (self.bits / 2, self.e):
+            return rsa_prime(bits, e)
+        return self.queue.get()
+
+    def genkeys(self, bits, e):
+        return rsa_keys(e=e, *rsa_genprimes(bits, e, self.prime))
+
+    def close(self):
+        for p in self.workers:
+            p.terminate()
+
+
+class RSAKeyCache(object):
+    """Pre-generated RSA primes persisted to a JSON file. Each run hands out
+    the stored keys for a (bits, e) in order and only generates (and saves)
+    new ones once those run out. New primes come from `pool` if given.
+    """
+    def __init__(self, path, pool=None):
+        self.path, self.pool = path, pool
+        try:
+            with open(path) as f:
+                self.keys = json.load(f)
+        except IOError:
+            self.keys = {}
+        self.used = defaultdict(int)
+
+    def genkeys(self, bits, e):
+        name = '%d:%d' % (bits, e)
+        keys = self.keys.setdefault(name, [])
+        if self.used[name] == len(keys):
+            fprime = self.pool.prime if self.pool else rsa_prime
+            keys.append(rsa_genprimes(bits, e, fprime))
+            self.save()
+        p, q = keys[self.used[name]]
+        self.used[name] += 1
+        return rsa_keys(p, q, e)
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump(self.keys, f)
+
+
+#where rsa_genkeys gets keys from, instead of generating them (RSAKeyPool or RSAKeyCache)
+keysource = None
 
 
 dsa_p = long(''.join("""
@@ -118,6 +198,28 @@ def dsa_sign(p, q, g, x, h, leak_k=False):
     return r, s
 
 
+def shamir_pow(g, a, y, b, p, w=2):
+    """g**a * y**b % p in a single squaring chain (Shamir's trick), taking
+    w bits of both exponents per step from a table of every g**i * y**j.
+    """
+    size = 1 << w
+    gpow, ypow = [1], [1]
+    for _ in xrange(size - 1):
+        gpow.append(gpow[-1] * g % p)
+        ypow.append(ypow[-1] * y % p)
+    table = [gi * yj % p for yj in ypow for gi in gpow]
+    mask = size - 1
+    bits = max(a.bit_length(), b.bit_length())
+    result = 1
+    for i in xrange((bits + w - 1) // w * w - w, -1, -w):
+        for _ in xrange(w):
+            result = result * result % p
+        d = ((b >> i) & mask) << w | ((a >> i) & mask)
+        if d:
+            result = result * table[d] % p
+    return result
+
+
 def dsa_verify(pubkey, h, sig):
     p, q, g, y = pubkey
     r, s = sig
@@ -130,15 +232,364 @@ def dsa_verify(pubkey, h, sig):
     w = invmod(s, q)
     u1 = (h * w) % q
     u2 = (r * w) % q
-    v = ((pow(g, u1, p) * pow(y, u2, p)) % p) % q
+    v = shamir_pow(g, u1, y, u2, p) % q
     return v == r
 
 
+class FixedBasePow(object):
+    """pow(g, e, N) for fixed g and N, from a table of g**(d * 2**(w*i)) for
+    every w-bit digit d at every digit position i. An exponentiation then
+    costs one multiplication per nonzero digit of e and no squarings.
+    Exponents wider than `bits` fall back to pow().
+    """
+    def __init__(self, g, N, bits, w=8):
+        self.N, self.w, self.mask = N, w, (1 << w) - 1
+        self.bits = bits
+        self.table = []
+        base = g % N
+        for _ in xrange((bits + w - 1) // w):
+            row = [1]
+            for _ in xrange(self.mask):
+                row.append(row[-1] * base % N)
+            self.table.append(row)
+            base = row[-1] * base % N
+        self.g = g
+
+    def __call__(self, e):
+        if e.bit_length() > self.bits:
+            return pow(self.g, e, self.N)
+        N, w, mask = self.N, self.w, self.mask
+        result = 1
+        for row in self.table:
+            if not e:
+                break
+            d = e & mask
+            if d:
+                result = result * row[d] % N
+            e >>= w
+        return result
+
+
+fixed_base_tables = {}
+
+def fixed_base(g, p, bits, w=8):
+    """Cached FixedBasePow for exponents of up to `bits` bits in group (p, g)."""
+    key = g, p, bits, w
+    if key not in fixed_base_tables:
+        fixed_base_tables[key] = FixedBasePow(g, p, bits, w)
+    return fixed_base_tables[key]
+
+
+class DSAVerifier(object):
+    """dsa_verify for many signatures under one public key. g**u1 comes from
+    the domain's shared fixed-base table; y**u2 from a table of its own, so
+    once built each verification is a few dozen modmuls and no squarings.
+    """
+    def __init__(self, pubkey, w=8):
+        p, q, g, y = pubkey
+        self.p, self.q = p, q
+        self.gpow = fixed_base(g, p, q.bit_length(), w)
+        self.ypow = FixedBasePow(y, p, q.bit_length(), w)
+
+    def verify(self, h, sig):
+        p, q = self.p, self.q
+        r, s = sig
+        w = invmod(s, q)
+        u1 = (h * w) % q
+        u2 = (r * w) % q
+        v = (self.gpow(u1) * self.ypow(u2) % p) % q
+        return v == r
+
+
+def dsa_verify_batch(pubkey, items):
+    """Verify (h, sig) pairs all signed under pubkey. Returns a list of bools.
+    Few signatures don't pay for the tables and go through dsa_verify.
+    """
+    items = list(items)
+    if len(items) < 64:
+        return [dsa_verify(pubkey, h, sig) for h, sig in items]
+    verifier = DSAVerifier(pubkey)
+    return [verifier.verify(h, sig) for h, sig in items]
+
+
 def dsa_recover_x(q, h, sig, k):
     r, s = sig
     return (((s * k) - h) * invmod(r, q) % q)
 
 
+def dsa_read_signatures(fname, y):
+    """Stream (y, r, s, m) from a dump of msg/s/r/m line groups like cc44's,
+    all signed under the public key y.
+    """
+    with open(fname) as f:
+        for lines in grouper(4, f, ''):
+            msg, s, r, m = [x.strip('\n').split(':')[1][1:] for x in lines]
+            yield y, long(r), long(s), long(m, 16)
+
+
+def dsa_scan_repeated_nonces(p, q, g, signatures):
+    """Find private keys exposed by nonce reuse in a stream of (y, r, s, m)
+    signatures (m being the message hash) under the domain (p, q, g).
+
+    Signatures sharing y and r share k. Only the first signature for each
+    (y, r) is kept, under an 8-byte digest of the pair, so memory grows
+    with the number of distinct nonces rather than parsed records. Each
+    key yields (y, k, x) once, from its first colliding pair whose x
+    checks out against y; later signatures under that key are skipped.
+    """
+    seen = {}
+    recovered = set()
+    for y, r, s, m in signatures:
+        if y in recovered:
+            continue
+        tag = hashlib.sha1('%x:%x' % (y, r)).digest()[:8]
+        first = seen.get(tag)
+        if first is None:
+            seen[tag] = s, m
+            continue
+        s1, m1 = first
+        if (s - s1) % q == 0:
+            continue
+        k = (m - m1) * invmod((s - s1) % q, q) % q
+        x = dsa_recover_x(q, m, (r, s), k)
+        if pow(g, x, p) == y:
+            recovered.add(y)
+            yield y, k, x
+
+
+def dsa_nonce_walk(p, q, g, r, k_max, k_min=1):
+    """Find k in [k_min, k_max] with (g**k % p) % q == r, one modmul per step."""
+    gk = pow(g, k_min, p)
+    for k in xrange(k_min, k_max + 1):
+        if gk % q == r:
+            return k
+        gk = gk * g % p
+    return None
+
+
+def dsa_nonce_bsgs(pubkey, h, sig, k_max, k_min=1):
+    """Find the nonce k in [k_min, k_max] of a signature by baby-step
+    giant-step, in about 2*sqrt(k_max - k_min) modmuls and sqrt(...) memory.
+
+    Verification rebuilds g**k % p (not just r) as g**(h/s) * y**(r/s), which
+    gives BSGS a group element to solve for.
+    """
+    p, q, g, y = pubkey
+    r, s = sig
+    w = invmod(s, q)
+    target = shamir_pow(g, h * w % q, y, r * w % q, p)
+    mask = 2 ** 64 - 1
+
+    m = int(math.ceil(math.sqrt(k_max - k_min + 1)))
+    #baby steps: g**j for j < m, keyed by their low 64 bits
+    baby = {}
+    gj = 1
+    for j in xrange(m):
+        baby.setdefault(gj & mask, j)
+        gj = gj * g % p
+    #giant steps: target * g**-(k_min + i*m)
+    giant = invmod(gj, p)
+    x = target * invmod(pow(g, k_min, p), p) % p
+    for i in xrange(m + 1):
+        j = baby.get(x & mask)
+        if j is not None:
+            k = k_min + i * m + j
+            if k <= k_max and pow(g, k, p) == target:
+                return k
+        x = x * giant % p
+    return None
+
+
+def dsa_recover_k(pubkey, h, sig, k_max, k_min=1):
+    """Nonce of a signature made with k in [k_min, k_max]: a direct walk
+    for small ranges, baby-step giant-step for large ones.
+    """
+    p, q, g, y = pubkey
+    if k_max - k_min < 2 ** 12:
+        return dsa_nonce_walk(p, q, g, sig[0], k_max, k_min)
+    return dsa_nonce_bsgs(pubkey, h, sig, k_max, k_min)
+
+
+def lll_reduce(basis, delta=0.99):
+    """LLL-reduce the rows of an integer basis in place and return it.
+
+    Schnorr-Euchner: the rows and their Gram matrix are kept exact, only
+    the Gram-Schmidt coefficients are floats, recomputed for the current
+    row on every visit so rounding errors don't accumulate.
+    """
+    b = basis
+    n = len(b)
+    gram = [[sum(x * y for x, y in zip(u, v)) for v in b] for u in b]
+    mu = [[0.0] * n for _ in xrange(n)]
+    bstar = [0.0] * n      #squared Gram-Schmidt norms
+    bstar[0] = float(gram[0][0])
+    k = 1
+    while k < n:
+        while True:
+            #Gram-Schmidt coefficients of row k
+            muk = mu[k]
+            rk = [0.0] * k
+            for j in xrange(k):
+                rkj = float(gram[k][j])
+                muj = mu[j]
+                for i in xrange(j):
+                    rkj -= muj[i] * rk[i]
+                rk[j] = rkj
+                muk[j] = rkj / bstar[j]
+            bstar[k] = float(gram[k][k]) - sum(muk[j] * rk[j] for j in xrange(k))
+            #size reduction, redone from scratch after a large step
+            redo = False
+            for j in xrange(k - 1, -1, -1):
+                if abs(muk[j]) <= 0.51:
+                    continue
+                c = long(round(muk[j]))
+                b[k] = [x - c * y for x, y in zip(b[k], b[j])]
+                gk, gj = gram[k], gram[j]
+                gkk = gk[k] - 2 * c * gk[j] + c * c * gj[j]
+                for i in xrange(n):
+                    gk[i] -= c * gj[i]
+                    gram[i][k] = gk[i]
+                gk[k] = gkk
+                muj = mu[j]
+                for i in xrange(j):
+                    muk[i] -= c * muj[i]
+                muk[j] -= c
+                if abs(c) > 2 ** 26:
+                    redo = True
+            if not redo:
+                break
+        if bstar[k] >= (delta - muk[k - 1] ** 2) * bstar[k - 1]:
+            k += 1
+        else:
+            b[k], b[k - 1] = b[k - 1], b[k]
+            gram[k], gram[k - 1] = gram[k - 1], gram[k]
+            for row in gram:
+                row[k], row[k - 1] = row[k - 1], row[k]
+            if k == 1:
+                bstar[0] = float(gram[0][0])
+            k = max(k - 1, 1)
+    return b
+
+
+def dsa_hnp_recover_x(pubkey, samples, leak_bits, msb=True):
+    """Private key from signatures whose nonces leak their top (msb) or
+    bottom leak_bits bits, as a hidden number problem (Boneh-Venkatesan).
+
+    samples are (h, (r, s), leak) with leak the known bits of k. Writing
+    k = a + 2**shift * b, with the unknown b below B, each signature gives
+    b = t*x + u mod q for known t and u. Those are rows of a lattice,
+    embedded with x itself so that the short vector LLL finds reads off
+    the first nonce. Returns x, or None if the lattice was too small.
+    """
+    p, q, g, y = pubkey
+    n = q.bit_length()
+    if msb:
+        shift, bound = 0, 2 ** (n - leak_bits)
+    else:
+        shift, bound = leak_bits, (q >> leak_bits) + 1
+    inv_shift = invmod(2 ** shift, q)
+    scale = -(-q // bound)
+    d = len(samples)
+
+    ts, us, knowns = [], [], []
+    for h, (r, s), leak in samples:
+        a = leak << (n - leak_bits) if msb else leak
+        w = invmod(s, q)
+        ts.append(inv_shift * w * r % q)
+        us.append(inv_shift * (w * h - a) % q)
+        knowns.append(a)
+
+    #target: ((2*b_i - B) * scale for each i, 2*x - q, M), all centered
+    embed = q // 2
+    basis = []
+    for i in xrange(d):
+        row = [0] * (d + 2)
+        row[i] = 2 * q * scale
+        basis.append(row)
+    basis.append([2 * t * scale for t in ts] + [2, 0])
+    basis.append([(2 * u - bound) * scale for u in us] + [-q, embed])
+    lll_reduce(basis)
+
+    h, sig, _ = samples[0]
+    for row in basis:
+        if abs(row[-1]) != embed:
+            continue
+        if row[-1] < 0:
+            row = [-v for v in row]
+        b = (row[0] // scale + bound) // 2
+        x = dsa_recover_x(q, h, sig, knowns[0] + (b << shift))
+        if pow(g, x, p) == y:
+            return x
+    return None
+
+
+def dsa_leaky_signatures(p, q, g, x, count, leak_bits, msb=True):
+    """count (h, sig, leak) signatures of random hashes, leaking leak_bits
+    top or bottom bits of each nonce."""
+    n = q.bit_length()
+    samples = []
+    for _ in xrange(count):
+        h = random.getrandbits(n)
+        sig, k = dsa_sign(p, q, g, x, h, leak_k=True)
+        leak = k >> (n - leak_bits) if msb else k & (2 ** leak_bits - 1)
+        samples.append((h, sig, leak))
+    return samples
+
+
+def dsa_hnp_benchmark(leak_bits=8, count=None, msb=True, trials=3):
+    """Recover random keys from leaky signatures over the cc43 domain.
+    Plain LLL needs about 4 or more leaked bits per nonce for 160-bit q.
+    """
+    p, q, g = dsa_p, dsa_q, dsa_g
+    count = count or int(1.7 * q.bit_length() / leak_bits) + 2
+    for _ in xrange(trials):
+        pubkey, x = dsa_genkeys(p, q, g)
+        samples = dsa_leaky_signatures(p, q, g, x, count, leak_bits, msb)
+        if not all(dsa_verify_batch(pubkey, [(h, sig) for h, sig, _ in samples])):
+            raise Exception('bad signature')
+        tstart = time.time()
+        found = dsa_hnp_recover_x(pubkey, samples, leak_bits, msb)
+        print '%d %s bits x %d signatures (dimension %d): %s in %.1fs' % (
+                leak_bits, 'top' if msb else 'bottom', count, count + 2,
+                'recovered' if found == x else 'failed', time.time() - tstart)
+
+
+def unpadded_recover(fdecrypt, pubkey, c, S=None):
+    """Plaintext of c from an oracle that won't decrypt c itself, by having
+    it decrypt c * S**e instead and dividing S back out. None if the
+    oracle (returning None) refused that too."""
+    e, n = pubkey
+    if S is None:
+        S = random.randint(2, n - 1)
+    p_prime = fdecrypt(pow(S, e, n) * c % n)
+    if p_prime is None:
+        return None
+    return p_prime * invmod(S, n) % n
+
+
+def parity_decrypt(fparity, pubkey, c, fguess=None):
+    """Decrypt c with an oracle that tells whether a ciphertext's plaintext
+    is odd (cc46).
+
+    Each doubling of the plaintext halves the interval it can be in: after
+    i steps it lies in (n*lo / 2**i, n*(lo+1) / 2**i), so only the integer
+    numerator lo is kept. fguess gets the upper bound after every step.
+    """
+    e, n = pubkey
+    double = pow(2, e, n)
+    lo = 0
+    steps = n.bit_length()
+    for i in xrange(1, steps + 1):
+        c = c * double % n
+        lo <<= 1
+        if fparity(c):
+            lo += 1
+        if fguess:
+            fguess((n * (lo + 1)) >> i)
+    #the interval is now narrower than 1
+    return ceil_div(n * lo, 2 ** steps)
+
+
 def padding_oracle(k, privkey, c):
     m = rsa_decrypt(c, *privkey)
     m = '\x00' * (k - len(m)) + m #I2OSP
@@ -153,66 +604,253 @@ def pkcs_pad(k, m):
     return ''.join(['\x00\x02', pad, '\x00', m])
 
 
-def bleichencrack(fcrypt, k, pubkey, c):
-    e, n = pubkey
-    B = 2 ** (8 * (k-2))
-    Mi = set([(2 * B, 3 * B - 1)])
-    c0, si = c, 1 #skip blinding (step 1)
-    for i in itertools.count(1):
-        Mi_1 = Mi
-        si_1 = si
-        if i == 1:
-            #2.a
-            si = n / (3 * B)
-            while not fcrypt(c0 * pow(si, e, n)):
-                si += 1
-            #print '%s 2.a si: %s' % (i, si)
-        elif len(Mi_1) > 1:
-            #2.b
-            si = si_1 + 1
-            while not fcrypt(c0 * pow(si, e, n)):
-                si += 1
-            #print '%s 2.b si: %s' % (i, si)
-        else:
-            #2.c
-            a, b = list(Mi_1)[0]
-            ri = 2 * ((b * si_1 - 2 * B) / n)
-            found = False
-            while not found:
-                si = (2 * B + ri * n) / b
-                si_hi = (3 * B + ri * n) / a
-                while si <= si_hi:
-                    if fcrypt(c0 * pow(si, e, n)):
-                        found = True
-                        break
-                    si += 1
-                ri += 1
-            #print '%s 2.b si: %s' % (i, si)
-
-        #3
-        Mi = set()
-        for a, b in Mi_1:
-            r, mod = divmod(a * si - 3 * B + 1, n)
-            if mod:
-                r += 1
-            r_hi = (b * si - 2 * B) / n
+def ceil_div(a, b):
+    return -(-a // b)
+
+
+class IntervalSet(object):
+    """Disjoint closed intervals of integers, kept merged and sorted as two
+    parallel lists of bounds, so finding where (lo, hi) goes is a pair of
+    bisections. The number of integers covered is kept up to date too.
+    """
+    def __init__(self, intervals=()):
+        self.los, self.his = [], []
+        self.width = 0
+        for lo, hi in intervals:
+            self.add(lo, hi)
+
+    def add(self, lo, hi):
+        """Add [lo, hi], merging it with every interval it overlaps or touches."""
+        los, his = self.los, self.his
+        i = bisect.bisect_left(his, lo - 1)
+        j = bisect.bisect_right(los, hi + 1, i)
+        if i < j:
+            lo, hi = min(lo, los[i]), max(hi, his[j - 1])
+            self.width -= sum(b - a + 1 for a, b in zip(los[i:j], his[i:j]))
+        los[i:j] = [lo]
+        his[i:j] = [hi]
+        self.width += hi - lo + 1
+
+    def __len__(self):
+        return len(self.los)
+
+    def __getitem__(self, i):
+        return self.los[i], self.his[i]
+
+    def __iter__(self):
+        return itertools.izip(self.los, self.his)
+
+    def bits(self):
+        """log2 of the number of integers still covered."""
+        return math.log(self.width, 2)
+
+
+bb_state = None
+
+def bb_init_worker(fcrypt, c0, e, n):
+    global bb_state
+    bb_state = fcrypt, c0, e, n
+
+
+def bb_test_chunk(svals):
+    """(index of the first conformant s or None, oracle queries made)"""
+    fcrypt, c0, e, n = bb_state
+    for i, s in enumerate(svals):
+        if fcrypt(c0 * pow(s, e, n) % n):
+            return i, i + 1
+    return None, len(svals)
+
+
+class Bleichenbacher(object):
+    """Bleichenbacher's '98 attack on a PKCS#1 v1.5 padding oracle.
+
+    fcrypt(c) is the oracle. With processes > 1 the searches for s in
+    steps 2.a-2.c query the oracle in chunks of candidates spread over a
+    worker pool, a round at a time, and take the first conformant s in
+    search order. fprogress(i, queries, intervals) is called after every
+    step 3.
+
+    mode='trimmers' adds the improvements of Bardou et al. ("Efficient
+    Padding Oracle Attacks on Cryptographic Hardware", 2012): trimmers
+    shrink [2B, 3B) before step 2.a, which then starts at (n + 2B) / b and
+    skips the holes of s values that can't give a conformant plaintext.
+    """
+    def __init__(self, fcrypt, k, pubkey, processes=1, chunksize=32, fprogress=None,
+            mode='classic', trimmers=500):
+        if mode not in ('classic', 'trimmers'):
+            raise ValueError('unknown mode: %s' % mode)
+        self.mode, self.trimmers = mode, trimmers
+        self.fcrypt, self.k = fcrypt, k
+        self.e, self.n = pubkey
+        self.B = 2 ** (8 * (k-2))
+        self.processes, self.chunksize = processes, chunksize
+        self.fprogress = fprogress
+        self.queries = 0
+        self.pool = None
+
+    def search(self, c0, candidates):
+        """First s from the candidates iterator that gives a conformant c0 * s**e."""
+        e, n = self.e, self.n
+        if self.pool is None:
+            for s in candidates:
+                self.queries += 1
+                if self.fcrypt(c0 * pow(s, e, n) % n):
+                    return s
+            return None
+
+        while True:
+            chunks = [list(itertools.islice(candidates, self.chunksize)) for _ in xrange(self.processes)]
+            chunks = [chunk for chunk in chunks if chunk]
+            if not chunks:
+                return None
+            found = None
+            for chunk, (hit, queries) in zip(chunks, self.pool.map(bb_test_chunk, chunks)):
+                self.queries += queries
+                if hit is not None and found is None:
+                    found = chunk[hit]
+            if found is not None:
+                return found
+
+    def conformant(self, c0, u, t):
+        """Query whether c0 * (u/t)**e is conformant."""
+        e, n = self.e, self.n
+        self.queries += 1
+        return self.fcrypt(c0 * pow(u * invmod(t, n), e, n) % n)
+
+    def trim(self, c0):
+        """Trimmers: m0 * u/t mod n is just m0 * u/t when t divides m0, so a
+        conformant c0 * (u/t)**e means 2B <= m0 * u/t < 3B. Fractions
+        2/3 < u/t < 3/2 are tried by increasing t, up to self.trimmers
+        queries. Returns the narrowed interval for m0.
+        """
+        B = self.B
+        hits = []
+        queries = 0
+        for t in itertools.count(3):
+            for u in xrange(2 * t // 3 + 1, ceil_div(3 * t, 2)):
+                if u == t or GCD(u, t) != 1:
+                    continue
+                if queries == self.trimmers:
+                    break
+                queries += 1
+                if self.conformant(c0, u, t):
+                    hits.append((u, t))
+            else:
+                continue
+            break
+        if not hits:
+            return 2 * B, 3 * B - 1
+
+        #every hit's t divides m0, so does their lcm
+        tl = reduce(lambda x, y: x * y // GCD(x, y), (t for _, t in hits))
+        if tl > 2 ** 12:
+            tl = max(t for _, t in hits)
+        fracs = [u * tl // t for u, t in hits if tl % t == 0] + [tl]
+        u_min, u_max = min(fracs), max(fracs)
+        #push the extreme fractions over the common denominator further out
+        while 3 * (u_min - 1) > 2 * tl and self.conformant(c0, u_min - 1, tl):
+            u_min -= 1
+        while 2 * (u_max + 1) < 3 * tl and self.conformant(c0, u_max + 1, tl):
+            u_max += 1
+        return ceil_div(2 * B * tl, u_min), ceil_div(3 * B * tl, u_max) - 1
+
+    def step2a_candidates(self, a, b):
+        """s values in order, skipping those for which no m0 in [a, b] can
+        give jn + 2B <= s * m0 < jn + 3B for any wrap count j.
+        """
+        B, n = self.B, self.n
+        s = ceil_div(n + 2 * B, b)
+        for j in itertools.count(1):
+            s = max(s, ceil_div(j * n + 2 * B, b))
+            s_hi = (j * n + 3 * B - 1) // a
+            while s <= s_hi:
+                yield s
+                s += 1
+
+    def step2c_candidates(self, a, b, s):
+        B, n = self.B, self.n
+        r = ceil_div(2 * (b * s - 2 * B), n)
+        while True:
+            s = ceil_div(2 * B + r * n, b)
+            s_hi = ceil_div(3 * B + r * n, a)
+            while s < s_hi:
+                yield s
+                s += 1
+            r += 1
+
+    def step3(self, Mi, s):
+        B, n = self.B, self.n
+        intervals = IntervalSet()
+        for a, b in Mi:
+            r = ceil_div(a * s - 3 * B + 1, n)
+            r_hi = (b * s - 2 * B) // n
             while r <= r_hi:
-                lo, mod = divmod(2 * B + r * n, si)
-                if mod:
-                    lo += 1
-                lo = max(a, lo)
-                hi = min(b, divmod(3 * B - 1 + r * n, si)[0])
-                Mi.add((lo,hi))
+                lo = max(a, ceil_div(2 * B + r * n, s))
+                hi = min(b, (3 * B - 1 + r * n) // s)
+                if lo <= hi:
+                    intervals.add(lo, hi)
                 r += 1
-        #print '%s 3 Mi: %s' % (i, Mi)
-
-        #4
-        if len(Mi) == 1:
-            a, b = list(Mi)[0]
-            if a == b:
-                m = long_to_bytes(a)
-                m = '\x00' * (k - len(m)) + m
-                return m
+        return intervals
+
+    def crack(self, c):
+        B, n = self.B, self.n
+        Mi = IntervalSet([(2 * B, 3 * B - 1)])
+        c0, si = c, 1 #skip blinding (step 1)
+        if self.processes > 1:
+            self.pool = multiprocessing.Pool(self.processes, bb_init_worker, (self.fcrypt, c0, self.e, n))
+        try:
+            for i in itertools.count(1):
+                if i == 1 and self.mode == 'trimmers':
+                    #2.a after trimming, skipping holes
+                    Mi = IntervalSet([self.trim(c0)])
+                    si = self.search(c0, self.step2a_candidates(*Mi[0]))
+                elif i == 1:
+                    #2.a
+                    si = self.search(c0, itertools.count(ceil_div(n, 3 * B)))
+                elif len(Mi) > 1:
+                    #2.b
+                    si = self.search(c0, itertools.count(si + 1))
+                else:
+                    #2.c
+                    a, b = Mi[0]
+                    si = self.search(c0, self.step2c_candidates(a, b, si))
+
+                #3
+                Mi = self.step3(Mi, si)
+                if self.fprogress:
+                    self.fprogress(i, self.queries, Mi)
+
+                #4
+                if len(Mi) == 1 and Mi[0][0] == Mi[0][1]:
+                    m = long_to_bytes(Mi[0][0])
+                    return '\x00' * (self.k - len(m)) + m
+        finally:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool = None
+
+
+def bleichencrack(fcrypt, k, pubkey, c, **options):
+    return Bleichenbacher(fcrypt, k, pubkey, **options).crack(c)
+
+
+def bleichenbacher_benchmark(bits=1024, trials=9, e=65537):
+    """Median oracle queries per decryption, classic and with trimmers."""
+    k = bits / 8
+    queries = defaultdict(list)
+    for _ in xrange(trials):
+        pubkey, privkey = rsa_genkeys(bits, e)
+        fcrypt = partial(padding_oracle, k, privkey)
+        pmsg = pkcs_pad(k, "kick it, CC")
+        c = rsa_encrypt(pmsg, *pubkey)
+        for mode in ('classic', 'trimmers'):
+            bb = Bleichenbacher(fcrypt, k, pubkey, mode=mode)
+            if bb.crack(c) != pmsg:
+                raise Exception('%s attack recovered the wrong plaintext' % mode)
+            queries[mode].append(bb.queries)
+    for mode in ('classic', 'trimmers'):
+        print '%d bits, %-8s: median %d queries (%d trials)' % (
+                bits, mode, sorted(queries[mode])[trials // 2], trials)
 
 
 def cc41():
@@ -269,7 +907,7 @@ Implement that attack.
     def decrypt(pubkey, C):
         h = hashlib.sha1(long_to_bytes(C)).hexdigest()
         if h in seen or pubkey not in keypairs:
-            return 'ERROR'
+            return None
         seen.add(h)
 
         privkey = keypairs[pubkey]
@@ -285,14 +923,15 @@ Implement that attack.
     print 'Decrypted: ', decrypt(pubkey, C)
     print 'Replayed:  ', decrypt(pubkey, C)
 
-    E, N = pubkey
-    S = random.randint(1, N)
-    C_prime = (pow(S, E, N) * C) % N
-
-    P_prime = decrypt(pubkey, C_prime)
-    P_prime = bytes_to_long(P_prime)
-    P = (P_prime * invmod(S, N)) % N
+    def fdecrypt(c):
+        p = decrypt(pubkey, c)
+        return None if p is None else bytes_to_long(p)
+    P = unpadded_recover(fdecrypt, pubkey, C)
     print 'Recovered: ', long_to_bytes(P)
+    print
+
+    print 'Against a decryption service, see oraclebench.py:'
+    print '  ./oraclebench.py --messages 2000 --concurrency 8'
 
 
 def cc42():
@@ -373,31 +1012,24 @@ so this uses an intentionally broken signature verifier that doesn't check paddi
 
     msg = "hi mom"
 
-    #generate sig with throwaway key to get asn1+hash
-    key = RSA.generate(1024, e=3)
-    h = SHA.new(msg)
-    ss = PKCS1_v1_5.new(key)
-    psig = ss.sign(h)
-    raw = key.encrypt(psig, 0)[0]
-    print 'Generate sig with throwaway key to get asn1+hash'
-    print 'Valid Sig:', raw.encode('hex')
-    print 'Verified: ', broken_verify_rsa_sha1(msg, key, psig)
-
-    #build the new block
-    asn1_hash = raw[raw.find('\xff\x00')+1:]
-    prefix = '\x01' + '\xff' * 4
-    suffix = '\x01' * 87
-    sig = prefix + asn1_hash + suffix
-    #print sig.encode('hex')
-    x = bytes_to_long(sig)
-    newsig = nth_root(x, 3)
-
-    #generate new key with e=3 to test forgery
+    #00 01 ff .. ff 00 ASN.1 HASH GARBAGE, with as much garbage as cubing needs
+    forger = rsaforge.Forger(1024, 'sha1')
+    forged = forger.sign(msg)
+    x = bytes_to_long(forged)
+    print 'Forged block:', long_to_bytes(x**3).encode('hex')
+    print 'Garbage bytes:', forger.garbage
+
+    #any key with e=3 accepts it
     key = RSA.generate(1024, e=3)
     print
     print 'Test forgery with new key'
-    print 'Forged Sig:', long_to_bytes(newsig**3).encode('hex')
-    print 'Verified: ', broken_verify_rsa_sha1(msg, key, long_to_bytes(newsig))
+    print 'Verified: ', broken_verify_rsa_sha1(msg, key, forged)
+    print 'Verified without the key object:', rsaforge.verify_broken(msg, forged, key.n)
+    print 'Verified by a strict verifier:', rsaforge.verify_strict(msg, forged, key.n)
+    print
+
+    print 'Forging in bulk:'
+    rsaforge.benchmark([1024, 2048, 4096], ['sha1', 'sha256'], 1000)
 
 
 def cc43():
@@ -511,15 +1143,15 @@ bb283e6633451e535c45513b2d33c99ea17""".strip().split()), 16)
     pubkey = p, q, g, y
     sig = r, s
 
-    for k in xrange(1, 2**16 + 1):
-        rx = pow(g, k, p) % q
-        if rx == r:
-            break
-
+    k = dsa_recover_k(pubkey, h, sig, 2**16)
     print 'Found k:', k
     x = dsa_recover_x(q, h, sig, k)
     print 'Recovered x:', x
     print 'Match:', x_hash == hashlib.sha1(hex(x)[2:-1]).hexdigest()
+    print
+
+    print 'Nonces leaking only some of their bits, by lattice reduction:'
+    dsa_hnp_benchmark(leak_bits=8, trials=1)
 
 
 def cc44():
@@ -559,13 +1191,6 @@ What's my private key? Its SHA-1 (from hex) is:
 
     ca8f6f7c66fa362d40760d135b763eb8527d3d52
 """
-    def gen_messages(fname): 
-        with open(fname) as f:
-            for lines in grouper(4, f, ''):
-                msg, s, r, m = [x.strip('\n').split(':')[1][1:] for x in lines]
-                yield msg, long(s), long(r), long(m, 16)
-
-
     y = long(''.join("""
 2d026f4bf30195ede3a088da85e398ef869611d0f68f07
 13d51c9c1a3a26c95105d915e2d8cdf26d056b86b8a7b8
@@ -577,21 +1202,11 @@ f98a6a4d83d8279ee65d71c1203d2c96d65ebbf7cce9d3
     p, q, g = dsa_p, dsa_q, dsa_g
 
     #r = pow(g, k, p) % q, so signatures with shared k will share r
-    r_data = {}
-    for msg1, s1, r1, m1 in gen_messages('data/cc44.txt'):
-        if r1 in r_data:
-            msg2, s2, m2 = r_data[r1]
-            break
-        r_data[r1] = msg1, s1, m1
-
-    m = (m1 - m2) % q
-    s = (s1 - s2) % q
-    k = m * invmod(s, q)
-
-    print 'Found k:', k
-    x = dsa_recover_x(q, m1, (r1, s1), k)
-    print 'Recovered x:', x
-    print 'Match:', x_hash == hashlib.sha1(hex(x)[2:-1]).hexdigest()
+    signatures = dsa_read_signatures('data/cc44.txt', y)
+    for _, k, x in dsa_scan_repeated_nonces(p, q, g, signatures):
+        print 'Found k:', k
+        print 'Recovered x:', x
+        print 'Match:', x_hash == hashlib.sha1(hex(x)[2:-1]).hexdigest()
 
 
 def cc45():
@@ -713,7 +1328,6 @@ you'll see the message decrypt "hollywood style".
 
 Decrypt the string (after encrypting it to a hidden private key, duh) above.
 """
-    rsa_decrypt_long = pow
     def parity_oracle(privkey, c):
         return rsa_decrypt_long(c, *privkey) & 1
 
@@ -724,16 +1338,11 @@ Decrypt the string (after encrypting it to a hidden private key, duh) above.
     msg = msg.decode('base64')
     c = rsa_encrypt(msg, *pubkey)
 
-    e, n = pubkey
-    lo, hi = Fraction(0), Fraction(n)
-    for _ in xrange(int(math.log(n, 2))+1):
-        c = c * pow(2, e, n)
-        m = (lo + hi) / 2
-        if fcrypt(c):
-            lo = m
-        else:
-            hi = m
-        print long_to_bytes(long(hi))
+    def show(hi):
+        print long_to_bytes(hi)
+
+    m = parity_decrypt(fcrypt, pubkey, c, fguess=show)
+    print 'Decrypted:', long_to_bytes(m)
 
 
 def cc47():
@@ -824,6 +1433,10 @@ trying to grok how the math works.
     pm = bleichencrack(fcrypt, k, pubkey, c)
     print 'Recovered: ', repr(pm)
     print 'Match:', pm == pmsg
+    print
+
+    print 'Oracle queries, classic attack vs trimmers and hole skipping:'
+    bleichenbacher_benchmark(bits=bits, trials=5)
 
 
 def cc48():
@@ -880,12 +1493,20 @@ does not work well in practice*
     print 'Padded msg:', repr(pmsg)
     c = rsa_encrypt(pmsg, *pubkey)
 
-    pm = bleichencrack(fcrypt, k, pubkey, c)
+    def progress(i, queries, intervals):
+        print '  step %d: %d interval(s), %d queries, %.1f bits left' % (
+                i, len(intervals), queries, intervals.bits())
+
+    pm = bleichencrack(fcrypt, k, pubkey, c,
+            processes=multiprocessing.cpu_count(), fprogress=progress)
     print 'Recovered: ', repr(pm)
     print 'Match:', pm == pmsg
 
 
 if __name__ == '__main__':
+    #optional: reuse RSA keys saved in a JSON file across runs
+    if len(sys.argv) > 1:
+        keysource = RSAKeyCache(sys.argv[1])
     for f in (cc41, cc42, cc43, cc44, cc45, cc46, cc47, cc48):
         print f.__doc__.split('\n')[0]
         f()
@@ -1,11 +1,12 @@
 #!/usr/bin/env python
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from functools import partial
 import itertools
 import random
 import string
 import struct
 import sys
+import time
 import zlib
 
 from Crypto.Cipher import AES
@@ -27,14 +28,111 @@ def xor_block(b1, b2):
     return ''.join(chr(ord(x) ^ ord(y)) for x,y in zip(b1, b2))
 
 
+class CBCMAC(object):
+    """CBC-MAC of a message fed in pieces, like the hashlib objects: every
+    full block is chained into the state as soon as it arrives, the last
+    partial block is padded when the digest is taken.
+    """
+    block_size = 16
+    chunk_size = 1 << 16
+
+    def __init__(self, key, iv='\0' * 16, data=''):
+        self.key = key
+        self.state, self.buf = iv, ''
+        if data:
+            self.update(data)
+
+    def update(self, data):
+        if self.buf:
+            data = self.buf + data
+        end = len(data) - len(data) % self.block_size
+        for i in xrange(0, end, self.chunk_size):
+            chunk = data[i:min(i + self.chunk_size, end)]
+            self.state = AES.new(self.key, mode=AES.MODE_CBC, IV=self.state).encrypt(chunk)[-self.block_size:]
+        self.buf = data[end:]
+
+    def copy(self):
+        """Snapshot of the MAC state, to be continued independently."""
+        other = CBCMAC(self.key, self.state)
+        other.buf = self.buf
+        return other
+
+    def digest(self):
+        return AES.new(self.key, mode=AES.MODE_CBC, IV=self.state).encrypt(pkcs7_pad(self.block_size, self.buf))
+
+    def hexdigest(self):
+        return self.digest().encode('hex')
+
+
 def cbc_mac_sign(key, iv, msg):
-    return AES.new(key, mode=AES.MODE_CBC, IV=iv).encrypt(pkcs7_pad(16, msg))[-16:]
+    return CBCMAC(key, iv, msg).digest()
 
 
 def cbc_mac_validate(key, iv, msg, mac):
     return cbc_mac_sign(key, iv, msg) == mac
 
 
+class CBCMACCache(object):
+    """CBC-MACs under one key and IV of messages that start with one of the
+    remembered prefixes. The MAC state after the longest matching prefix
+    is resumed, so only the rest of the message gets encrypted. Finding it
+    costs a slice and dict lookup per distinct prefix length. Up to `size`
+    prefixes are kept, least recently used dropped first.
+    """
+    def __init__(self, key, iv='\0' * 16, size=1024):
+        self.key, self.iv = key, iv
+        self.size = size
+        self.states = OrderedDict()
+        self.lengths = defaultdict(int)  #prefix length -> prefixes of that length
+
+    def remember(self, prefix):
+        if prefix in self.states:
+            return
+        if len(self.states) >= self.size:
+            old, _ = self.states.popitem(last=False)
+            self.lengths[len(old)] -= 1
+            if not self.lengths[len(old)]:
+                del self.lengths[len(old)]
+        self.states[prefix] = CBCMAC(self.key, self.iv, prefix)
+        self.lengths[len(prefix)] += 1
+
+    def mac(self, msg):
+        for n in sorted(self.lengths, reverse=True):
+            if n > len(msg):
+                continue
+            prefix = msg[:n]
+            state = self.states.pop(prefix, None)
+            if state is not None:
+                self.states[prefix] = state
+                h = state.copy()
+                h.update(msg[n:])
+                return h.digest()
+        return CBCMAC(self.key, self.iv, msg).digest()
+
+    def validate(self, msg, mac):
+        return self.mac(msg) == mac
+
+
+def cbc_mac_benchmark(count=2000, prefix_size=1 << 16):
+    """Validate requests sharing a long transaction list prefix, MAC-ing
+    each from scratch and resuming from the cached prefix state.
+    """
+    key, iv = random_key(16), '\0' * 16
+    txs = ';'.join('acct%d:SB%d' % (i, i) for i in xrange(prefix_size // 12))
+    prefix = 'from=V.Ictm&tx_list=' + txs
+    msgs = [prefix + ';Alice:SB%d' % i for i in xrange(count)]
+    macs = [cbc_mac_sign(key, iv, msg) for msg in msgs]
+    print "Validating %d byte requests that share all but the tail:" % len(prefix)
+
+    cache = CBCMACCache(key, iv)
+    cache.remember(prefix)
+    for name, fvalidate in (('full', partial(cbc_mac_validate, key, iv)), ('cached', cache.validate)):
+        tstart = time.time()
+        valid = sum(fvalidate(msg, mac) for msg, mac in zip(msgs, macs))
+        elapsed = time.time() - tstart
+        print '  %-6s: %d/%d valid in %.3fs (%.0f/s)' % (name, valid, count, elapsed, count / elapsed)
+
+
 def cc49():
     """49. CBC-MAC Message Forgery
 
@@ -169,6 +267,9 @@ Food for thought:
     print '  Valid:', fvalidate(badiv, badmsg, mac)
     print
 
+    cbc_mac_benchmark()
+    print
+
 
     print "TODO: Part 2 - length extension:"
     return
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Keep-alive HTTP request driver for timing and oracle attacks.
+
+Requests go through a pool of persistent httplib connections, so probes
+don't pay for a new TCP handshake each time (servers that answer with
+HTTP/1.0 close the socket, and the connection transparently reopens).
+map() keeps one probe in flight per pooled connection while still
+timing every request on its own.
+"""
+import httplib
+from multiprocessing.pool import ThreadPool
+import Queue
+import socket
+import timeit
+import urlparse
+
+#highest resolution wall clock available (time.time on unix, time.clock on windows)
+timer = timeit.default_timer
+
+
+class HTTPDriver(object):
+    def __init__(self, url, connections=1, timeout=None):
+        parts = urlparse.urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.path = parts.path or '/'
+        self.connections = connections
+        self.pool = Queue.Queue()
+        for _ in xrange(connections):
+            self.pool.put(httplib.HTTPConnection(self.host, self.port, timeout=timeout))
+        self.workers = None
+
+    def request(self, query=''):
+        """GET path?query on a pooled connection and return (elapsed, status)."""
+        return self.fetch(query)[:2]
+
+    def fetch(self, query=''):
+        """Like request(), returning (elapsed, status, body)."""
+        path = self.path + ('?' + query if query else '')
+        conn = self.pool.get()
+        try:
+            for attempt in (1, 2):
+                try:
+                    tstart = timer()
+                    conn.request('GET', path, headers={'Connection': 'keep-alive'})
+                    r = conn.getresponse()
+                    body = r.read()
+                    return timer() - tstart, r.status, body
+                except (httplib.HTTPException, socket.error):
+                    #server dropped the keep-alive connection, reconnect once
+                    conn.close()
+                    if attempt == 2:
+                        raise
+        finally:
+            self.pool.put(conn)
+
+    def get_status(self, query=''):
+        return self.request(query)[1]
+
+    def map(self, func, iterable):
+        """Like map(), with up to one call in flight per pooled connection."""
+        if self.connections == 1:
+            return map(func, iterable)
+        if self.workers is None:
+            self.workers = ThreadPool(self.connections)
+        return self.workers.map(func, iterable)
+
+    def close(self):
+        if self.workers is not None:
+            self.workers.close()
+            self.workers = None
+        while not self.pool.empty():
+            self.pool.get().close()
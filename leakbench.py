@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""Load-generation benchmark for the timingleak oracle server.
+
+Starts timingleak.py locally (unless --url points at a running server),
+drives it through HTTPDriver with a weighted mix of routes, and reports
+throughput, latency percentiles and the timing signal an attacker sees:
+the median gap between probes whose first signature byte is right and
+probes whose first byte is wrong, against the spread of those timings.
+
+  ./leakbench.py --server threaded --concurrency 16 --mix test32=3,test31=1
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib
+
+from httpdriver import HTTPDriver, timer
+
+
+def percentile(sorted_lst, pct):
+    if not sorted_lst:
+        return 0
+    return sorted_lst[min(len(sorted_lst) - 1, int(len(sorted_lst) * pct / 100.0))]
+
+
+def median(lst):
+    return percentile(sorted(lst), 50)
+
+
+def spawn_server(script, args, port):
+    """Spawn a server script that sits next to this file, wait until it
+    accepts connections on port and return (process, first output line).
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+    proc = subprocess.Popen([sys.executable, '-u', path] + args,
+            stdout=subprocess.PIPE, preexec_fn=os.setsid)
+    line = proc.stdout.readline().strip()
+    if not line:
+        #stdout closed before the first line: the server died on startup
+        proc.wait()
+    for _ in xrange(100):
+        if proc.poll() is not None:
+            raise Exception('%s exited with status %d' % (script, proc.returncode))
+        try:
+            socket.create_connection(('localhost', port)).close()
+            return proc, line
+        except socket.error:
+            time.sleep(0.05)
+    stop_server(proc)
+    raise Exception('%s did not start' % script)
+
+
+def start_server(server, port, workers):
+    """Spawn timingleak.py and return (process, valid signature of 'foo')."""
+    return spawn_server('timingleak.py', ['--quiet', '--server', server,
+            '--port', str(port), '--workers', str(workers)], port)
+
+
+def stop_server(proc):
+    #prefork workers share the server's process group
+    os.killpg(proc.pid, signal.SIGTERM)
+    proc.wait()
+
+
+def parse_mix(mix):
+    routes = []
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        routes.extend([name] * int(weight or 1))
+    return routes
+
+
+def run_benchmark(baseurl, sig, routes, requests, concurrency):
+    """Fire `requests` probes, alternating right and wrong first bytes."""
+    wrong = '0' if sig[0] != '0' else '1'
+    drivers = dict((name, HTTPDriver('%s/%s' % (baseurl, name), connections=concurrency))
+            for name in set(routes))
+
+    jobs = []
+    for i in xrange(requests):
+        name = random.choice(routes)
+        hit = i % 2 == 0
+        jobs.append((name, hit, 'file=foo&signature=' + (sig[0] if hit else wrong)))
+
+    def probe(job):
+        name, hit, query = job
+        elapsed, status = drivers[name].request(query)
+        return name, hit, elapsed
+
+    pool = drivers.values()[0]
+    tstart = timer()
+    results = pool.map(probe, jobs)
+    wall = timer() - tstart
+    for driver in drivers.itervalues():
+        driver.close()
+    return results, wall
+
+
+def report(results, wall):
+    print 'Requests: %d in %.2fs (%.1f req/s)' % (len(results), wall, len(results) / wall)
+    for name in sorted(set(r[0] for r in results)):
+        times = sorted(t for n,_,t in results if n == name)
+        hits = [t for n,hit,t in results if n == name and hit]
+        misses = [t for n,hit,t in results if n == name and not hit]
+        print '/%s: %d requests' % (name, len(times))
+        print '  latency ms: p50 %.2f  p90 %.2f  p99 %.2f  max %.2f' % tuple(
+                1000 * percentile(times, pct) for pct in (50, 90, 99, 100))
+        if hits and misses:
+            gap = median(hits) - median(misses)
+            noise = median([abs(t - median(misses)) for t in misses])
+            print '  signal: %.3fms  noise (MAD): %.3fms  ratio: %.1f' % (
+                    1000 * gap, 1000 * noise, gap / noise if noise else float('inf'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', help='benchmark a running server instead, e.g. http://localhost:9000')
+    parser.add_argument('--sig', help="valid signature of 'foo' on the --url server")
+    parser.add_argument('--server', default='threaded', help='timingleak.py --server mode')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--mix', default='test32', help='weighted routes, e.g. test32=3,test31=1')
+    args = parser.parse_args()
+    if args.url and not args.sig:
+        parser.error('--url needs --sig')
+
+    proc = None
+    if args.url:
+        baseurl, sig = args.url.rstrip('/'), args.sig
+    else:
+        proc, sig = start_server(args.server, args.port, args.workers)
+        baseurl = 'http://localhost:%d' % args.port
+    try:
+        urllib.urlopen(baseurl + '/metrics?reset=1').read()
+        results, wall = run_benchmark(baseurl, sig, parse_mix(args.mix), args.requests, args.concurrency)
+        report(results, wall)
+        print
+        print 'Server metrics:'
+        print json.dumps(json.loads(urllib.urlopen(baseurl + '/metrics').read()), indent=2, sort_keys=True)
+    finally:
+        if proc:
+            stop_server(proc)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""Bulk unpadded-RSA blinding attack against the rsaoracle server (cc41).
+
+Starts rsaoracle.py locally (unless --url points at a running server).
+Victims get their messages decrypted first. Replaying their
+ciphertexts then fails. Finally every message is recovered by
+submitting a blinded ciphertext c * S**e instead. The report gives
+throughput per phase and the oracle's seen-set counters.
+
+  ./oraclebench.py --messages 5000 --concurrency 16 --lru 1000
+"""
+import argparse
+import json
+import random
+import time
+import urllib
+
+from httpdriver import HTTPDriver, timer
+from leakbench import spawn_server, stop_server
+import crypto06
+
+
+def start_server(port, bits, e, lru, bloom):
+    """Spawn rsaoracle.py and return (process, public key)."""
+    proc, line = spawn_server('rsaoracle.py', ['--quiet', '--port', str(port),
+            '--bits', str(bits), '-e', str(e), '--lru', str(lru), '--bloom', str(bloom)], port)
+    return proc, tuple(long(x, 16) for x in line.split())
+
+
+def make_messages(count):
+    return [json.dumps({'time': int(time.time()), 'social': '%03d-%02d-%04d' % (
+            random.randrange(1000), random.randrange(100), random.randrange(10000))})
+            for _ in xrange(count)]
+
+
+class OracleClient(object):
+    def __init__(self, baseurl, connections):
+        self.driver = HTTPDriver(baseurl + '/decrypt', connections=connections)
+
+    def decrypt(self, c):
+        """Plaintext of c, or None if the oracle refused it."""
+        _, status, body = self.driver.fetch('c=%x' % c)
+        if status != 200:
+            return None
+        return long(body, 16)
+
+    def close(self):
+        self.driver.close()
+
+
+def timed_map(client, func, items):
+    tstart = timer()
+    results = client.driver.map(func, items)
+    return results, timer() - tstart
+
+
+def run_attack(baseurl, pubkey, count, concurrency):
+    msgs = make_messages(count)
+    ciphertexts = [crypto06.rsa_encrypt(m, *pubkey) for m in msgs]
+    client = OracleClient(baseurl, concurrency)
+    try:
+        plain, wall = timed_map(client, client.decrypt, ciphertexts)
+        report_phase('victims', count, wall, sum(p is not None for p in plain))
+
+        replayed, wall = timed_map(client, client.decrypt, ciphertexts)
+        report_phase('replays', count, wall, sum(p is not None for p in replayed))
+
+        def attack(c):
+            #a Bloom filter false positive refuses a blinded ciphertext now
+            #and then, another S gets through
+            for _ in xrange(3):
+                p = crypto06.unpadded_recover(client.decrypt, pubkey, c)
+                if p is not None:
+                    return p
+        recovered, wall = timed_map(client, attack, ciphertexts)
+        matches = sum(crypto06.bytes_to_long(m) == p for m, p in zip(msgs, recovered))
+        report_phase('blinded', count, wall, matches)
+    finally:
+        client.close()
+
+
+def report_phase(name, count, wall, ok):
+    print '%-8s %d requests in %.2fs (%.0f/s), %d succeeded' % (
+            name, count, wall, count / wall, ok)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', help='attack a running server instead, e.g. http://localhost:9041')
+    parser.add_argument('--port', type=int, default=9041)
+    parser.add_argument('--bits', type=int, default=1024)
+    parser.add_argument('-e', type=int, default=3)
+    parser.add_argument('--lru', type=int, default=1000, help='rsaoracle.py --lru')
+    parser.add_argument('--bloom', type=int, default=100000, help='rsaoracle.py --bloom')
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    proc = None
+    if args.url:
+        baseurl = args.url.rstrip('/')
+        key = json.loads(urllib.urlopen(baseurl + '/pubkey').read())
+        pubkey = long(key['e'], 16), long(key['n'], 16)
+    else:
+        proc, pubkey = start_server(args.port, args.bits, args.e, args.lru, args.bloom)
+        baseurl = 'http://localhost:%d' % args.port
+    try:
+        run_attack(baseurl, pubkey, args.messages, args.concurrency)
+        print
+        print 'Oracle stats:'
+        print json.dumps(json.loads(urllib.urlopen(baseurl + '/stats').read()), indent=2, sort_keys=True)
+    finally:
+        if proc:
+            stop_server(proc)
+
+
+if __name__ == '__main__':
+    main()
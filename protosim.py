@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""Event-driven simulator for the generator protocol actors of cc34-cc38.
+
+An actor is a generator that yields the message it sends and receives the
+reply through send(). A session is a chain of actors: the initiator first,
+any number of interceptors (MITM) in the middle and the responder last.
+Each message travels the chain hop by hop to the responder, and its reply
+travels back, until the initiator yields None:
+
+    alice -> mallory -> bob -> mallory -> alice -> ...
+
+run_sessions() interleaves many sessions on one event loop, delivering a
+single hop per tick, over in-memory or localhost TCP channels, and
+collects per-session latency and message counts.
+"""
+from collections import deque
+import cPickle as pickle
+import socket
+import struct
+import sys
+import timeit
+
+timer = timeit.default_timer
+
+
+class Channel(object):
+    """In-memory message queue for one direction of one hop."""
+    def __init__(self):
+        self.queue = deque()
+
+    def send(self, msg):
+        self.queue.append(msg)
+
+    def recv(self):
+        return self.queue.popleft()
+
+    def close(self):
+        pass
+
+
+class TCPChannel(object):
+    """Messages pickled over a localhost TCP connection."""
+    listener = None
+
+    def __init__(self):
+        if TCPChannel.listener is None:
+            TCPChannel.listener = socket.socket()
+            TCPChannel.listener.bind(('127.0.0.1', 0))
+            TCPChannel.listener.listen(128)
+        self.out = socket.create_connection(TCPChannel.listener.getsockname())
+        self.out.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.inp, _ = TCPChannel.listener.accept()
+        self.reader = self.inp.makefile('rb')
+
+    def send(self, msg):
+        data = pickle.dumps(msg, 2)
+        self.out.sendall(struct.pack('>I', len(data)) + data)
+
+    def recv(self):
+        size, = struct.unpack('>I', self.reader.read(4))
+        return pickle.loads(self.reader.read(size))
+
+    def close(self):
+        self.reader.close()
+        self.inp.close()
+        self.out.close()
+
+
+class Session(object):
+    def __init__(self, actors, channel=Channel):
+        self.actors = actors
+        self.forward = [channel() for _ in actors[1:]]  #actor i -> i+1
+        self.backward = [channel() for _ in actors[1:]] #actor i+1 -> i
+        self.pos, self.dir = 0, 1
+        self.messages = self.intercepted = 0
+        self.started = self.finished = None
+        self.error = None
+
+    def outbox(self):
+        return self.forward[self.pos] if self.dir == 1 else self.backward[self.pos - 1]
+
+    def start(self):
+        self.started = timer()
+        msg = self.actors[0].next()
+        for actor in self.actors[1:]:
+            actor.next()
+        self.outbox().send(msg)
+
+    def step(self):
+        """Deliver the message in flight one hop. Returns False when done."""
+        msg = self.outbox().recv()
+        self.pos += self.dir
+        try:
+            reply = self.actors[self.pos].send(msg)
+        except Exception as e:
+            self.error = e
+            return self.finish()
+        self.messages += 1
+        if 0 < self.pos < len(self.actors) - 1:
+            self.intercepted += 1
+        if self.pos == len(self.actors) - 1:
+            self.dir = -1
+        elif self.pos == 0:
+            if reply is None:
+                return self.finish()
+            self.dir = 1
+        self.outbox().send(reply)
+        return True
+
+    def finish(self):
+        self.finished = timer()
+        for chan in self.forward + self.backward:
+            chan.close()
+        return False
+
+    @property
+    def latency(self):
+        return self.finished - self.started
+
+
+class NullWriter(object):
+    def write(self, data):
+        pass
+
+
+def run_sessions(factory, count, concurrency=None, channel=Channel, quiet=True):
+    """Run count sessions of the actor chains returned by factory(), with up
+    to `concurrency` (default: all) in flight at once. Actor output is
+    discarded when quiet. Returns the finished Session objects.
+    """
+    concurrency = concurrency or count
+    pending = (Session(factory(), channel) for _ in xrange(count))
+    active, done = deque(), []
+    stdout = sys.stdout
+    if quiet:
+        sys.stdout = NullWriter()
+    try:
+        for session in pending:
+            session.start()
+            active.append(session)
+            if len(active) == concurrency:
+                break
+        while active:
+            session = active.popleft()
+            if session.step():
+                active.append(session)
+                continue
+            done.append(session)
+            for new in pending:
+                new.start()
+                active.append(new)
+                break
+    finally:
+        sys.stdout = stdout
+    return done
+
+
+def report(sessions, wall):
+    latencies = sorted(s.latency for s in sessions)
+    pct = lambda p: 1000 * latencies[min(len(latencies) - 1, int(len(latencies) * p / 100.0))]
+    print 'Sessions: %d in %.2fs (%.0f/s), errors: %d' % (
+            len(sessions), wall, len(sessions) / wall, sum(1 for s in sessions if s.error))
+    print 'Messages: %d, intercepted: %d' % (
+            sum(s.messages for s in sessions), sum(s.intercepted for s in sessions))
+    print 'Latency ms: p50 %.2f  p90 %.2f  p99 %.2f' % (pct(50), pct(90), pct(99))
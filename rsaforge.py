@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+"""Bleichenbacher's low-exponent RSA signature forgery (cc42).
+
+A verifier that parses 00 01 ff .. ff 00 DIGESTINFO HASH from the left and
+ignores whatever follows accepts any signature whose e'th power, taken
+over the integers, starts with those bytes. The forger lays the block
+out with as many ff bytes as it can and trailing garbage just wide enough
+that some e'th power lands in the window of blocks that share the prefix,
+then takes the ceiling root of the bottom of that window. No key is
+needed: the cube is smaller than any modulus of the right size.
+
+  ./rsaforge.py --bits 1024 2048 --hash sha1 sha256 --count 1000
+"""
+import argparse
+import hashlib
+import os
+import random
+import timeit
+
+timer = timeit.default_timer
+
+#DER DigestInfo headers from RFC 3447, section 9.2
+DIGEST_INFO = {
+    'md5': '3020300c06082a864886f70d020505000410'.decode('hex'),
+    'sha1': '3021300906052b0e03021a05000414'.decode('hex'),
+    'sha224': '302d300d06096086480165030402040500041c'.decode('hex'),
+    'sha256': '3031300d060960864801650304020105000420'.decode('hex'),
+    'sha384': '3041300d060960864801650304020205000430'.decode('hex'),
+    'sha512': '3051300d060960864801650304020305000440'.decode('hex'),
+}
+
+
+def bytes_to_int(s):
+    return long(s.encode('hex') or '0', 16)
+
+
+def int_to_bytes(x, k):
+    """x as a big endian string of exactly k bytes."""
+    return ('%0*x' % (2 * k, x)).decode('hex')
+
+
+def nth_root(x, n):
+    """Finds the integer component of the n'th root of x,
+    an integer such that y ** n <= x < (y + 1) ** n.
+
+    Newton's method, started just above the root from a floating point
+    root of the leading bits of x, so it only needs a few iterations.
+    """
+    if x < 0:
+        raise ValueError('negative radicand')
+    if x < 2 or n == 1:
+        return x
+    if n < 512:
+        #x >> shift keeps 64 to 64+n bits, well within float range
+        shift = max(0, x.bit_length() - 64) // n * n
+        y = (int((x >> shift) ** (1.0 / n)) + 2) << (shift // n)
+    else:
+        y = 1 << -(-x.bit_length() // n)
+    #from above the root, Newton descends monotonically to the floor
+    while True:
+        z = ((n - 1) * y + x // y ** (n - 1)) // n
+        if z >= y:
+            return y
+        y = z
+
+
+def nth_root_ceil(x, n):
+    """The smallest integer y such that y ** n >= x."""
+    y = nth_root(x, n)
+    return y if y ** n == x else y + 1
+
+
+class Forger(object):
+    """Forges signatures under any public key of `bits` bits with exponent e,
+    for messages hashed with hashname and tagged with digest_info (the
+    standard DigestInfo for hashname by default).
+
+    The garbage width that worked last is tried first for the next message,
+    so a batch settles on one layout after the first forgery.
+    """
+    def __init__(self, bits, hashname='sha1', e=3, digest_info=None):
+        self.k = (bits + 7) // 8
+        self.hashname, self.e = hashname, e
+        self.digest_info = DIGEST_INFO[hashname] if digest_info is None else digest_info
+        self.hashlen = hashlib.new(hashname).digest_size
+        #bytes after 00 01 ff, 00 and the tagged hash
+        self.room = self.k - 4 - len(self.digest_info) - self.hashlen
+        if self.room < 0:
+            raise ValueError('%d-bit modulus too small for %s' % (bits, hashname))
+        #garbage of g bytes leaves a window of 2**(8g) blocks, and neighbouring
+        #e'th powers near 2**(8k) are about e * 2**(8k(e-1)/e) apart
+        self.garbage = max(0, min(self.room, 8 * self.k * (e - 1) // e // 8 - 1))
+
+    def forge(self, msg):
+        """Signature of msg as an integer, or None if no layout fits."""
+        tagged = self.digest_info + hashlib.new(self.hashname, msg).digest()
+        e = self.e
+        for garbage in xrange(self.garbage, self.room + 1):
+            ffs = 1 + self.room - garbage
+            block = bytes_to_int('\x00\x01' + '\xff' * ffs + '\x00' + tagged)
+            shift = 8 * garbage
+            sig = nth_root_ceil(block << shift, e)
+            if (sig ** e) >> shift == block:
+                self.garbage = garbage
+                return sig
+        return None
+
+    def sign(self, msg):
+        sig = self.forge(msg)
+        if sig is None:
+            raise ValueError('%d-byte block leaves at most %d bytes of garbage, '
+                    'too few for e=%d' % (self.k, self.room, self.e))
+        return int_to_bytes(sig, self.k)
+
+    def sign_many(self, msgs):
+        return [self.sign(msg) for msg in msgs]
+
+
+def forge(msg, bits, hashname='sha1', e=3, digest_info=None):
+    return Forger(bits, hashname, e, digest_info).sign(msg)
+
+
+def verify_broken(msg, sig, n, e=3, hashname='sha1', digest_info=None):
+    """The flawed check: 00 01, a run of ff, 00, DigestInfo and hash, with
+    anything at all allowed after the hash.
+    """
+    k = (n.bit_length() + 7) // 8
+    m = int_to_bytes(pow(bytes_to_int(sig), e, n), k)
+    if digest_info is None:
+        digest_info = DIGEST_INFO[hashname]
+    tagged = digest_info + hashlib.new(hashname, msg).digest()
+    if not m.startswith('\x00\x01\xff'):
+        return False
+    offset = m.find('\xff\x00') + 2
+    return m[offset:offset + len(tagged)] == tagged
+
+
+def verify_strict(msg, sig, n, e=3, hashname='sha1', digest_info=None):
+    """PKCS#1 v1.5 check: rebuild the whole expected block and compare."""
+    k = (n.bit_length() + 7) // 8
+    m = int_to_bytes(pow(bytes_to_int(sig), e, n), k)
+    if digest_info is None:
+        digest_info = DIGEST_INFO[hashname]
+    tagged = digest_info + hashlib.new(hashname, msg).digest()
+    return m == '\x00\x01' + '\xff' * (k - 3 - len(tagged)) + '\x00' + tagged
+
+
+def random_modulus(bits):
+    """Stand-in modulus of exactly `bits` bits. The forgeries never wrap
+    it, so the verifiers don't care that it can't be factored by anyone.
+    """
+    return random.getrandbits(bits) | (1 << (bits - 1)) | 1
+
+
+def benchmark(sizes, hashnames, count, e=3):
+    msgs = [os.urandom(16) for _ in xrange(count)]
+    for bits in sizes:
+        n = random_modulus(bits)
+        for hashname in hashnames:
+            try:
+                forger = Forger(bits, hashname, e)
+                forger.sign('')
+            except ValueError as err:
+                print '%5d bits %-6s: %s' % (bits, hashname, err)
+                continue
+            tstart = timer()
+            sigs = forger.sign_many(msgs)
+            elapsed = timer() - tstart
+            ok = sum(verify_broken(msg, sig, n, e, hashname) for msg, sig in zip(msgs, sigs))
+            strict = sum(verify_strict(msg, sig, n, e, hashname) for msg, sig in zip(msgs, sigs))
+            print '%5d bits %-6s: %d forged in %.2fs (%.0f/s), garbage %d bytes, ' \
+                    'accepted %d, strict %d' % (bits, hashname, count, elapsed,
+                    count / elapsed, forger.garbage, ok, strict)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--bits', type=int, nargs='+', default=[1024, 2048, 4096])
+    parser.add_argument('--hash', nargs='+', default=['sha1', 'sha256'], choices=sorted(DIGEST_INFO))
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('-e', type=int, default=3)
+    args = parser.parse_args()
+    benchmark(args.bits, args.hash, args.count, args.e)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""Unpadded RSA decryption oracle server for cc41.
+
+GET /decrypt?c=<hex> returns the plaintext integer in hex, once per
+ciphertext: the server remembers the SHA-1 of every ciphertext it has
+decrypted and answers 403 to a replay. Recent hashes are held exactly
+in a bounded LRU. Hashes evicted from it go into a Bloom filter, which
+keeps rejecting old ciphertexts in a few bits each (a small fraction of
+fresh ones get rejected too). When the filter fills up it becomes the
+previous generation, and the one before that is dropped. That sets how
+long a hash is remembered.
+
+The first line printed is the public key, "e n" in hex.
+"""
+import argparse
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Unpadded RSA decryption oracle for cc41')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=9041)
+    parser.add_argument('--server', default='threaded', choices=['wsgiref', 'threaded', 'gevent'],
+            help="the seen set lives in one process, so there's no prefork mode")
+    parser.add_argument('--bits', type=int, default=1024)
+    parser.add_argument('-e', type=int, default=3)
+    parser.add_argument('--keys', help='reuse RSA keys saved in this JSON file')
+    parser.add_argument('--lru', type=int, default=10000, help='hashes remembered exactly')
+    parser.add_argument('--bloom', type=int, default=1000000, help='hashes per Bloom filter generation')
+    parser.add_argument('--error', type=float, default=0.001, help='Bloom filter false positive rate')
+    parser.add_argument('--quiet', action='store_true', help="don't log requests")
+    args = parser.parse_args()
+    if args.server == 'gevent':
+        import gevent.monkey; gevent.monkey.patch_all()
+
+from collections import OrderedDict
+import hashlib
+import math
+import struct
+import threading
+import time
+
+from bottle import abort, request, route, run
+import crypto06
+import wsgiservers
+
+
+class BloomFilter(object):
+    """Bit array sized for `capacity` items at false positive rate `error`.
+    Items are already uniform hashes, so the bit positions come from
+    double hashing their first 16 bytes.
+    """
+    def __init__(self, capacity, error=0.001):
+        self.capacity = capacity
+        self.bits = max(8, int(-capacity * math.log(error) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.bits / float(capacity) * math.log(2))))
+        self.data = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def positions(self, digest):
+        h1, h2 = struct.unpack('>QQ', digest[:16])
+        h2 |= 1
+        return [(h1 + i * h2) % self.bits for i in xrange(self.hashes)]
+
+    def add(self, digest):
+        for pos in self.positions(digest):
+            self.data[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, digest):
+        data = self.data
+        return all(data[pos >> 3] & (1 << (pos & 7)) for pos in self.positions(digest))
+
+    def full(self):
+        return self.count >= self.capacity
+
+
+class SeenSet(object):
+    """Hashes of the ciphertexts already decrypted. check_add() is atomic so
+    that two threads can't both get the same ciphertext through.
+    """
+    def __init__(self, lru_size=10000, bloom_capacity=1000000, error=0.001):
+        self.lru = OrderedDict()
+        self.lru_size = lru_size
+        self.bloom_capacity, self.error = bloom_capacity, error
+        self.bloom = BloomFilter(bloom_capacity, error)
+        self.old_bloom = None
+        self.lock = threading.Lock()
+        self.stats = dict.fromkeys(['added', 'lru_hits', 'bloom_hits', 'rotations'], 0)
+
+    def check_add(self, digest):
+        """Record digest and return True, or False if it was seen before."""
+        with self.lock:
+            if digest in self.lru:
+                self.stats['lru_hits'] += 1
+                return False
+            if digest in self.bloom or (self.old_bloom is not None and digest in self.old_bloom):
+                self.stats['bloom_hits'] += 1
+                return False
+            self.lru[digest] = True
+            self.stats['added'] += 1
+            if len(self.lru) > self.lru_size:
+                evicted, _ = self.lru.popitem(last=False)
+                if self.bloom.full():
+                    self.old_bloom = self.bloom
+                    self.bloom = BloomFilter(self.bloom_capacity, self.error)
+                    self.stats['rotations'] += 1
+                self.bloom.add(evicted)
+            return True
+
+    def report(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['lru'] = len(self.lru)
+            stats['bloom'] = self.bloom.count
+            stats['bloom_bytes'] = len(self.bloom.data)
+            return stats
+
+
+class Oracle(object):
+    def __init__(self, pubkey, privkey, seen):
+        self.pubkey, self.privkey = pubkey, privkey
+        self.seen = seen
+        self.started = time.time()
+
+    def decrypt(self, c):
+        """Plaintext of c (0 <= c < n), or None if c was decrypted before."""
+        if not self.seen.check_add(hashlib.sha1('%x' % c).digest()):
+            return None
+        return crypto06.rsa_decrypt_long(c, *self.privkey)
+
+oracle = None
+
+
+@route('/pubkey')
+def pubkey():
+    e, n = oracle.pubkey
+    return {'e': '%x' % e, 'n': '%x' % n}
+
+
+@route('/decrypt')
+def decrypt():
+    try:
+        c = long(request.query.c, 16)
+    except ValueError:
+        abort(400, 'c must be hex')
+    if not 0 <= c < oracle.pubkey[1]:
+        abort(400, 'c out of range')
+    m = oracle.decrypt(c)
+    if m is None:
+        abort(403, 'seen')
+    return '%x' % m
+
+
+@route('/stats')
+def stats():
+    stats = oracle.seen.report()
+    uptime = time.time() - oracle.started
+    stats.update(uptime=uptime, rps=stats['added'] / uptime if uptime else 0)
+    return stats
+
+
+def serve(pubkey, privkey, seen, server='threaded', host='localhost', port=9041, quiet=False):
+    """Start the oracle. Blocks until the server terminates."""
+    global oracle
+    oracle = Oracle(pubkey, privkey, seen)
+    run(server=wsgiservers.server_names[server], host=host, port=port, quiet=quiet)
+
+
+if __name__ == '__main__':
+    if args.keys:
+        crypto06.keysource = crypto06.RSAKeyCache(args.keys)
+    pub, priv = crypto06.rsa_genkeys(args.bits, args.e)
+    print '%x %x' % pub
+    serve(pub, priv, SeenSet(args.lru, args.bloom, args.error), args.server,
+            args.host, args.port, args.quiet)
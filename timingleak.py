@@ -1,13 +1,38 @@
 #!/usr/bin/env python
+import argparse
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HMAC-SHA1 timing leak server for cc31/cc32')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--server', default='wsgiref',
+            choices=['wsgiref', 'threaded', 'prefork', 'gevent'],
+            help='wsgiref is single threaded, gevent runs on an event loop')
+    parser.add_argument('--workers', type=int, default=4, help='processes for --server prefork')
+    parser.add_argument('--delay', type=float, default=5,
+            help='default per-byte delay in ms for /test')
+    parser.add_argument('--quiet', action='store_true', help="don't log requests")
+    args = parser.parse_args()
+    #gevent has to patch time.sleep and friends before bottle is imported
+    if args.server == 'gevent':
+        import gevent.monkey; gevent.monkey.patch_all()
+
+from collections import OrderedDict
 import hashlib
 import itertools
+import multiprocessing
 import random
+import threading
 import time
+import timeit
 
-from bottle import abort, request, route, run
+from bottle import abort, default_app, HTTPError, request, route, run
+from wordlist import open_wordlist
+from wsgiservers import server_names
 
 random.seed('matasano') #for reproducibility - will work with any seed
-key = random.choice(open('/usr/share/dict/words').readlines()).strip()
+key = open_wordlist().choice()
+delay = 5 #ms
 
 
 def xor_block(b1, b2):
@@ -26,6 +51,41 @@ def hmac_sha1(key, message):
     return sha1_hex(o_key_pad + sha1(i_key_pad + message))
 
 
+trans_5c = ''.join(chr(x ^ 0x5c) for x in xrange(256))
+trans_36 = ''.join(chr(x ^ 0x36) for x in xrange(256))
+
+
+class HMAC_SHA1(object):
+    """hmac_sha1 with the keyed inner and outer SHA-1 states computed once,
+    and the signatures of the most recently used messages cached.
+    """
+    def __init__(self, key, cache_size=4096):
+        if len(key) > 64:
+            key = hashlib.sha1(key).digest()
+        key += '\x00' * (64 - len(key))
+        self.inner = hashlib.sha1(key.translate(trans_36))
+        self.outer = hashlib.sha1(key.translate(trans_5c))
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+
+    def hexdigest(self, message):
+        with self.lock:
+            sig = self.cache.pop(message, None)
+            if sig is None:
+                inner = self.inner.copy()
+                inner.update(message)
+                outer = self.outer.copy()
+                outer.update(inner.digest())
+                sig = outer.hexdigest()
+                if len(self.cache) >= self.cache_size:
+                    self.cache.popitem(last=False)
+            self.cache[message] = sig
+            return sig
+
+signer = HMAC_SHA1(key)
+
+
 #import hmac
 #tests = [('', ''), ('A' * 10, 'Ice'), ('A' * 64, 'Ice'), ('A' * 70, 'Ice')]
 #for key,msg in tests:
@@ -46,16 +106,111 @@ def insecure_compare(sleep_secs, lhs, rhs):
 def test31():
     fname, sig = request.query.file, request.query.signature
     #return 'OK' if hmac_sha1(key, fname) == sig else abort(500)
-    return 'OK' if insecure_compare(0.05, hmac_sha1(key, fname), sig) else abort(500)
+    return 'OK' if insecure_compare(0.05, signer.hexdigest(fname), sig) else abort(500)
 
 
 @route('/test32')
 def test32():
     fname, sig = request.query.file, request.query.signature
     #return 'OK' if hmac_sha1(key, fname) == sig else abort(500)
-    return 'OK' if insecure_compare(0.005, hmac_sha1(key, fname), sig) else abort(500)
+    return 'OK' if insecure_compare(0.005, signer.hexdigest(fname), sig) else abort(500)
+
+
+@route('/test')
+def test():
+    """Like /test32, with the per-byte delay (in ms) taken from the query."""
+    fname, sig = request.query.file, request.query.signature
+    try:
+        sleep_secs = float(request.query.delay or delay) / 1000
+    except ValueError:
+        abort(400, 'delay must be a number of milliseconds')
+    return 'OK' if insecure_compare(sleep_secs, signer.hexdigest(fname), sig) else abort(500)
+
+
+class Metrics(object):
+    """Per-route request counters kept in shared memory so that every
+    worker process of the prefork server reports into the same table.
+    """
+    fields = ('requests', 'errors', 'total', 'max')
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.data = multiprocessing.Array('d', len(self.rules) * len(self.fields))
+        self.started = multiprocessing.Value('d', time.time())
+
+    def record(self, rule, elapsed, error):
+        i = self.rules.index(rule) * len(self.fields)
+        with self.data.get_lock():
+            self.data[i] += 1
+            self.data[i+1] += error
+            self.data[i+2] += elapsed
+            self.data[i+3] = max(self.data[i+3], elapsed)
+
+    def reset(self):
+        with self.data.get_lock():
+            for i in xrange(len(self.data)):
+                self.data[i] = 0
+            self.started.value = time.time()
+
+    def report(self):
+        uptime = time.time() - self.started.value
+        stats = {'uptime': uptime}
+        width = len(self.fields)
+        with self.data.get_lock():
+            for n, rule in enumerate(self.rules):
+                requests, errors, total, maxtime = self.data[n * width:(n + 1) * width]
+                stats[rule] = {
+                    'requests': int(requests),
+                    'errors': int(errors),
+                    'mean_ms': 1000 * total / requests if requests else 0,
+                    'max_ms': 1000 * maxtime,
+                    'rps': requests / uptime if uptime else 0}
+        return stats
+
+
+class MetricsPlugin(object):
+    name = 'metrics'
+    api = 2
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def apply(self, callback, route):
+        timer = timeit.default_timer
+        def wrapper(*args, **kwargs):
+            tstart, error = timer(), False
+            try:
+                return callback(*args, **kwargs)
+            except HTTPError:
+                error = True
+                raise
+            finally:
+                self.metrics.record(route.rule, timer() - tstart, error)
+        return wrapper
+
+
+metrics = None
+
+@route('/metrics')
+def show_metrics():
+    """Latency and throughput per route; /metrics?reset=1 zeroes the counters."""
+    stats = metrics.report()
+    if request.query.reset:
+        metrics.reset()
+    return stats
+
+
+def serve(server='wsgiref', host='localhost', port=9000, workers=4, quiet=False, debug=True):
+    """Start the leak server. Blocks until the server terminates."""
+    global metrics
+    app = default_app()
+    metrics = Metrics(r.rule for r in app.routes)
+    app.install(MetricsPlugin(metrics))
+    options = {'workers': workers} if server == 'prefork' else {}
+    run(app, server=server_names[server], host=host, port=port, quiet=quiet, debug=debug, **options)
 
 
 if __name__ == '__main__':
-    print hmac_sha1(key, 'foo')
-    run(host='localhost', port=9000, debug=True)
+    delay = args.delay
+    print signer.hexdigest('foo')
+    serve(args.server, args.host, args.port, args.workers, args.quiet)
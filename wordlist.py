@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""Memory-mapped word lists.
+
+The file is mapped read-only and indexed by line start offsets in a
+compact array, so picking random words is O(1) and nothing is copied into
+a Python list. Pages of the mapping are shared by every process reading
+the same file, and pool workers forked after the index is built share it
+too.
+"""
+from array import array
+import mmap
+import random
+
+DEFAULT_PATH = '/usr/share/dict/words'
+
+
+class WordList(object):
+    def __init__(self, path=DEFAULT_PATH):
+        with open(path, 'rb') as f:
+            try:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                #can't map an empty file
+                self.data = ''
+        self.offsets = self.index(self.data)
+
+    @staticmethod
+    def index(data):
+        """Start offset of every line, plus one past the end of the last."""
+        offsets = array('L', [0])
+        pos = data.find('\n')
+        while pos != -1:
+            offsets.append(pos + 1)
+            pos = data.find('\n', pos + 1)
+        if offsets[-1] != len(data):
+            offsets.append(len(data))
+        return offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('word index out of range')
+        return self.data[self.offsets[i]:self.offsets[i+1]].strip()
+
+    def __iter__(self):
+        return (self[i] for i in xrange(len(self)))
+
+    def choice(self, rng=random):
+        #same pick as rng.choice(open(path).readlines()).strip()
+        return self[int(rng.random() * len(self))]
+
+    def sample(self, k, rng=random):
+        return [self[i] for i in rng.sample(xrange(len(self)), k)]
+
+    def chunks(self, n, start=0, stop=None, rng=None):
+        """Yield lists of at most n words from the line range [start, stop),
+        in file order, or shuffled by rng if one is given. The shuffle
+        happens on the call, not on the first chunk.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        order = array('L', xrange(start, stop))
+        if rng is not None:
+            rng.shuffle(order)
+        return ([self[i] for i in order[lo:lo + n]] for lo in xrange(0, len(order), n))
+
+
+wordlists = {}
+
+def open_wordlist(path=DEFAULT_PATH):
+    """Shared WordList for path, mapped and indexed on first use."""
+    if path not in wordlists:
+        wordlists[path] = WordList(path)
+    return wordlists[path]
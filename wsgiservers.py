@@ -0,0 +1,57 @@
+"""Bottle server adapters shared by timingleak.py and rsaoracle.py.
+
+Import this after any gevent monkey-patching: SocketServer and bottle
+pull in threading.
+"""
+import multiprocessing
+import SocketServer
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+
+from bottle import ServerAdapter
+
+
+class BacklogWSGIServer(WSGIServer):
+    request_queue_size = 128
+
+
+class ThreadingWSGIServer(SocketServer.ThreadingMixIn, BacklogWSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(*args, **kw): pass
+
+
+class ThreadedServer(ServerAdapter):
+    """wsgiref with a thread per request."""
+    def run(self, handler):
+        if self.quiet:
+            self.options['handler_class'] = QuietHandler
+        srv = make_server(self.host, self.port, handler, server_class=ThreadingWSGIServer, **self.options)
+        srv.serve_forever()
+
+
+class PreforkServer(ServerAdapter):
+    """wsgiref in several processes accepting on one shared listening socket.
+    Options:
+
+        * `workers` (default: 4) number of processes, including this one.
+    """
+    def run(self, handler):
+        workers = self.options.pop('workers', 4)
+        if self.quiet:
+            self.options['handler_class'] = QuietHandler
+        srv = make_server(self.host, self.port, handler, server_class=BacklogWSGIServer, **self.options)
+        for _ in xrange(workers - 1):
+            p = multiprocessing.Process(target=srv.serve_forever)
+            p.daemon = True
+            p.start()
+        srv.serve_forever()
+
+
+server_names = {
+    'wsgiref': 'wsgiref',
+    'threaded': ThreadedServer,
+    'prefork': PreforkServer,
+    'gevent': 'gevent',
+}